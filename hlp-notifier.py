@@ -1,33 +1,207 @@
+import time
+
+# Measured as early as possible to report time-to-ready
+_process_started = time.perf_counter()
+
 import requests
 import os
 import json
+import gzip
+import itertools
+import math
+import re
+import signal
+import sys
+import threading
+from abc import ABC, abstractmethod
 from datetime import datetime, timedelta, timezone
-from hyperliquid.info import Info
-from hyperliquid.utils import constants
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, ContextTypes, filters
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InlineQueryResultArticle, InlineQueryResultCachedPhoto, InputTextMessageContent, MessageEntity
+from telegram.error import BadRequest, Forbidden, RetryAfter, TelegramError, TimedOut
+from telegram.ext import Application, CommandHandler, CallbackQueryHandler, InlineQueryHandler, MessageHandler, ContextTypes, filters
 import asyncio
+import contextvars
+import heapq
+import html
+import io
+import random
+from contextlib import contextmanager
+import multiprocessing
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 
 # Configuration
+# Required to run the bot (checked in main(), the replay CLI does not need it)
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
-if not TELEGRAM_BOT_TOKEN:
-    raise ValueError(
-        "TELEGRAM_BOT_TOKEN environment variable is required. "
-        "Please set it in your environment or Railway settings."
-    )
 
 HYPERLIQUID_API = "https://api.hyperliquid.xyz/info"
+HLP_VAULT_ADDRESS = "0xdfc24b077bc1425ad1dea75bcb6f8158e10df303"
 VAULTS_ANALYSER_API = "https://vaults-analyser.com/pub_api/v1"
 
 # Token for vaults-analyser.com (optional)
 VAULTS_ANALYSER_TOKEN = os.getenv("VAULTS_ANALYSER_TOKEN")
 
+# Where data comes from: 'live' (APIs) or 'fake' (FAKE_DATA_FILE fixture, offline)
+DATA_SOURCE = os.getenv("DATA_SOURCE", "live")
+FAKE_DATA_FILE = os.getenv("FAKE_DATA_FILE")
+
+# Latency added to every fake data source call (milliseconds)
+FAKE_LATENCY_MS = float(os.getenv("FAKE_LATENCY_MS", "0"))
+
+# Chat where charts are uploaded to obtain a file_id usable in inline mode (optional)
+CHART_CACHE_CHAT_ID = os.getenv("CHART_CACHE_CHAT_ID")
+
+# Number of worker processes used to render charts
+CHART_WORKERS = int(os.getenv("CHART_WORKERS", "2"))
+
+# Maximum number of rendered charts kept in memory
+CHART_CACHE_SIZE = 32
+
+# Maximum number of last built reports kept for inline mode (one per wallet)
+LAST_REPORT_CACHE_SIZE = 1000
+
+# Portfolio periods that can be charted
+CHART_PERIODS = ('day', 'week', 'month', 'allTime')
+
+# How long fetched data is reused before hitting the APIs again (seconds)
+VAULT_CACHE_TTL = int(os.getenv("VAULT_CACHE_TTL", "60"))
+DEPOSITORS_CACHE_TTL = int(os.getenv("DEPOSITORS_CACHE_TTL", "300"))
+EQUITY_CACHE_TTL = int(os.getenv("EQUITY_CACHE_TTL", "30"))
+
+# Per-user report rate limit: bucket of REPORT_BURST tokens refilled at REPORT_RATE_PER_MINUTE
+REPORT_RATE_PER_MINUTE = float(os.getenv("REPORT_RATE_PER_MINUTE", "4"))
+REPORT_BURST = int(os.getenv("REPORT_BURST", "3"))
+
+# Number of reports generated concurrently
+REPORT_WORKERS = int(os.getenv("REPORT_WORKERS", "4"))
+
+# Maximum concurrent requests to each upstream API
+HYPERLIQUID_MAX_CONCURRENCY = int(os.getenv("HYPERLIQUID_MAX_CONCURRENCY", "4"))
+VAULTS_ANALYSER_MAX_CONCURRENCY = int(os.getenv("VAULTS_ANALYSER_MAX_CONCURRENCY", "2"))
+
+# Timeout of every upstream request (seconds): a hung connection must not hold a
+# concurrency slot or a cache lock forever
+UPSTREAM_TIMEOUT = float(os.getenv("UPSTREAM_TIMEOUT", "10"))
+
+# Maximum time spent pre-warming caches at startup before accepting updates (seconds)
+STARTUP_WARMUP_TIMEOUT = float(os.getenv("STARTUP_WARMUP_TIMEOUT", "15"))
+
+# Maximum time given to in-flight work when the bot is stopped (seconds)
+SHUTDOWN_DRAIN_TIMEOUT = float(os.getenv("SHUTDOWN_DRAIN_TIMEOUT", "20"))
+
+# Directory where raw API responses of each report are captured for replay (optional)
+CAPTURE_DIR = os.getenv("CAPTURE_DIR")
+
+# Capture ring buffer bounds: oldest captures are deleted beyond these
+CAPTURE_MAX_FILES = int(os.getenv("CAPTURE_MAX_FILES", "200"))
+CAPTURE_MAX_BYTES = int(os.getenv("CAPTURE_MAX_BYTES", str(100 * 1024 * 1024)))
+
+# Fraction of reports profiled (0 disables profiling, 1 profiles every report)
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+
+# Also run cProfile on sampled reports (higher overhead than the phase timers)
+PROFILE_CPROFILE = os.getenv("PROFILE_CPROFILE", "0") == "1"
+
+# From Python 3.12 cProfile relies on sys.monitoring and records every thread while
+# enabled, mixing the event loop and concurrent reports into the sampled report:
+# in-process cProfile is only used before 3.12 (use `replay --profile` otherwise)
+CPROFILE_IN_PROCESS = PROFILE_CPROFILE and sys.version_info < (3, 12)
+
+# File where profiling stats are written every PROFILE_FLUSH_EVERY samples and on shutdown (optional)
+PROFILE_OUTPUT = os.getenv("PROFILE_OUTPUT")
+PROFILE_FLUSH_EVERY = int(os.getenv("PROFILE_FLUSH_EVERY", "50"))
+
+# Telegram user ids allowed to use admin commands (comma-separated)
+ADMIN_USER_IDS = {user_id.strip() for user_id in os.getenv("ADMIN_USER_IDS", "").split(",") if user_id.strip()}
+
+# Broadcast pacing: messages per second (Telegram allows ~30), concurrent senders, recipients per page
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))
+BROADCAST_WORKERS = int(os.getenv("BROADCAST_WORKERS", "8"))
+BROADCAST_PAGE_SIZE = int(os.getenv("BROADCAST_PAGE_SIZE", "500"))
+
+# Directory where per-recipient broadcast delivery statuses are logged
+BROADCAST_LOG_DIR = "broadcasts"
+
 # File to store user addresses
 USER_ADDRESSES_FILE = "user_addresses.json"
 
-# Dictionary to store user addresses (user_id -> address)
+# File to store resumable job state (e.g. interrupted broadcasts) across restarts
+BOT_STATE_FILE = "bot_state.json"
+
+# File where the vault snapshot and depositor index are saved on shutdown
+CACHE_FILE = "cache.json.gz"
+
+# Dictionary to store user addresses (user_id -> lowercase address)
 user_addresses = {}
 
+# Reverse index: lowercase address -> set of user_ids tracking it
+wallet_users = {}
+
+# True when user_addresses has changes that could not be written yet
+_addresses_dirty = False
+
+# Resumable job state, persisted to BOT_STATE_FILE
+bot_state = {}
+
+# Frozen clock (aware UTC datetime) used by replay, None to use the real time
+_frozen_now = None
+
+def utc_now():
+    """Current UTC time (frozen during replay)"""
+    return _frozen_now if _frozen_now is not None else datetime.now(timezone.utc)
+
+def local_now():
+    """Current local time shown in reports (frozen during replay, in UTC)"""
+    return _frozen_now.replace(tzinfo=None) if _frozen_now is not None else datetime.now()
+
+def write_json_atomic(path, data, compress=False):
+    """Writes JSON to a temporary file then renames it, so a kill never leaves a half-written file"""
+    payload = json.dumps(data, indent=None if compress else 2).encode('utf-8')
+    if compress:
+        payload = gzip.compress(payload)
+    
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+ADDRESS_PATTERN = re.compile(r'^0x[0-9a-fA-F]{40}$')
+
+def normalize_address(address, verify_checksum=True):
+    """Returns the lowercase form of a wallet address, or None if it is invalid
+
+    Mixed-case addresses must carry a valid EIP-55 checksum (unless verify_checksum is False).
+    """
+    address = address.strip()
+    if not ADDRESS_PATTERN.match(address):
+        return None
+    
+    hex_part = address[2:]
+    if verify_checksum and hex_part != hex_part.lower() and hex_part != hex_part.upper():
+        try:
+            from eth_utils import is_checksum_address
+        except ImportError:
+            # eth_utils ships with the Hyperliquid SDK; without it only the format is checked
+            return address.lower()
+        if not is_checksum_address(address):
+            return None
+    return address.lower()
+
+def remove_user_address(user_id):
+    """Forgets the address of a user and updates the reverse index"""
+    address = user_addresses.pop(user_id, None)
+    if address is not None:
+        wallet_users.get(address, set()).discard(user_id)
+        if not wallet_users.get(address):
+            wallet_users.pop(address, None)
+
+def set_user_address(user_id, address):
+    """Registers the (normalised) address of a user and updates the reverse index"""
+    remove_user_address(user_id)
+    user_addresses[user_id] = address
+    wallet_users.setdefault(address, set()).add(user_id)
+
 def load_user_addresses():
     """Load addresses from JSON file"""
     global user_addresses
@@ -38,91 +212,682 @@ def load_user_addresses():
     except Exception as e:
         print(f"Error loading addresses: {e}")
         user_addresses = {}
+    
+    # Normalise addresses saved before validation existed (accepted then without
+    # checksum verification, so keep doing so) and rebuild the reverse index
+    stored = user_addresses
+    user_addresses = {}
+    wallet_users.clear()
+    for user_id, address in stored.items():
+        normalized = normalize_address(address, verify_checksum=False) if isinstance(address, str) else None
+        if normalized:
+            set_user_address(user_id, normalized)
+        else:
+            print(f"Dropping invalid address of user {user_id}: {address}")
+    if user_addresses != stored:
+        save_user_addresses()
 
 def save_user_addresses():
     """Save addresses to JSON file"""
+    global _addresses_dirty
     try:
-        with open(USER_ADDRESSES_FILE, 'w') as f:
-            json.dump(user_addresses, f, indent=2)
+        write_json_atomic(USER_ADDRESSES_FILE, user_addresses)
+        _addresses_dirty = False
     except Exception as e:
+        _addresses_dirty = True
         print(f"Error saving addresses: {e}")
 
-def get_hlp_vault_performance():
-    """Retrieves HLP vault data"""
+def load_bot_state():
+    """Load resumable job state from JSON file"""
+    global bot_state
     try:
-        payload = {
-            "type": "vaultDetails",
-            "vaultAddress": "0xdfc24b077bc1425ad1dea75bcb6f8158e10df303"  # HLP vault address
-        }
-        response = requests.post(HYPERLIQUID_API, json=payload)
-        response.raise_for_status()
-        data = response.json()
-        return data
-    except requests.exceptions.RequestException as e:
-        print(f"Error retrieving vault data: {e}")
-        if hasattr(e, 'response') and e.response is not None:
-            print(f"Response status: {e.response.status_code}")
-            print(f"Response text: {e.response.text[:200]}")
-        return None
+        if os.path.exists(BOT_STATE_FILE):
+            with open(BOT_STATE_FILE, 'r') as f:
+                bot_state = json.load(f)
     except Exception as e:
-        print(f"Error retrieving vault data: {e}")
-        return None
+        print(f"Error loading bot state: {e}")
+        bot_state = {}
 
-def get_all_vault_depositors(vault_address):
-    """Retrieves the complete list of all vault depositors via vaults-analyser.com"""
-    if not VAULTS_ANALYSER_TOKEN:
-        return None
+def save_bot_state():
+    """Save resumable job state to JSON file"""
+    try:
+        write_json_atomic(BOT_STATE_FILE, bot_state)
+    except Exception as e:
+        print(f"Error saving bot state: {e}")
+
+# Profiling: a PROFILE_SAMPLE_RATE fraction of report requests record per-phase timings
+# (and cProfile stats with PROFILE_CPROFILE=1). The handler samples each request once;
+# the request's timings are carried by a context variable, which asyncio.to_thread
+# copies into worker threads and the report queue hands over to its worker.
+_perf_report = contextvars.ContextVar('perf_report', default=None)
+_perf_lock = threading.Lock()
+
+# phase -> {'count', 'total', 'max'} in seconds
+perf_stats = {}
+_perf_samples = 0
+
+# Aggregated cProfile stats of sampled reports, and the lock allowing one profiler at a time
+_cprofile_stats = None
+_cprofile_lock = threading.Lock()
+
+def sample_profile():
+    """Decides whether the current request is profiled (starting its timings) and returns the decision"""
+    sampled = PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+    _perf_report.set({'started': time.perf_counter(), 'phases': {}} if sampled else None)
+    return sampled
+
+async def finish_profile():
+    """Records the phase totals of a sampled request, once per phase, plus its end-to-end 'total'"""
+    global _perf_samples
+    timings = _perf_report.get()
+    if timings is None:
+        return
+    _perf_report.set(None)
     
+    with _perf_lock:
+        timings['phases']['total'] = time.perf_counter() - timings['started']
+        phases = dict(timings['phases'])
+        _perf_samples += 1
+        flush_due = PROFILE_OUTPUT and _perf_samples % PROFILE_FLUSH_EVERY == 0
+    for name, duration in phases.items():
+        record_phase(name, duration)
+    if flush_due:
+        await asyncio.to_thread(save_perf_stats)
+
+def record_phase(name, duration):
+    """Adds a phase duration to the aggregated timings"""
+    with _perf_lock:
+        stats = perf_stats.setdefault(name, {'count': 0, 'total': 0.0, 'max': 0.0})
+        stats['count'] += 1
+        stats['total'] += duration
+        stats['max'] = max(stats['max'], duration)
+
+@contextmanager
+def perf_phase(name):
+    """Adds the duration of a block to the phase total of a sampled request (no-op otherwise)"""
+    timings = _perf_report.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
     try:
-        url = f"{VAULTS_ANALYSER_API}/depositors/{vault_address}"
-        headers = {
-            "Authorization": f"Bearer {VAULTS_ANALYSER_TOKEN}",
-            "Content-Type": "application/json",
-            "Accept": "application/json"
-        }
-        
-        response = requests.get(url, headers=headers, timeout=10)
-        
-        if response.status_code == 200:
+        yield
+    finally:
+        duration = time.perf_counter() - started
+        with _perf_lock:
+            timings['phases'][name] = timings['phases'].get(name, 0.0) + duration
+
+def run_profiled(func, *args):
+    """Calls func, under cProfile when the report is sampled and CPROFILE_IN_PROCESS is set"""
+    global _cprofile_stats
+    # Only one profiler can be active at a time: skip cProfile if another thread holds it
+    if not (CPROFILE_IN_PROCESS and _perf_report.get() is not None and _cprofile_lock.acquire(blocking=False)):
+        return func(*args)
+    
+    import cProfile
+    import pstats
+    try:
+        profiler = cProfile.Profile()
+        result = profiler.runcall(func, *args)
+        if _cprofile_stats is None:
+            _cprofile_stats = pstats.Stats(profiler)
+        else:
+            _cprofile_stats.add(profiler)
+        return result
+    finally:
+        _cprofile_lock.release()
+
+def format_perf_stats():
+    """Returns the aggregated phase timings as a text table"""
+    with _perf_lock:
+        rows = sorted(perf_stats.items(), key=lambda item: item[1]['total'], reverse=True)
+        lines = [f"{'phase':<12}{'count':>7}{'avg ms':>9}{'max ms':>9}{'total s':>9}"]
+        for name, stats in rows:
+            avg_ms = stats['total'] / stats['count'] * 1000
+            lines.append(f"{name:<12}{stats['count']:>7}{avg_ms:>9.1f}{stats['max'] * 1000:>9.1f}{stats['total']:>9.2f}")
+    return "\n".join(lines)
+
+def format_cprofile_stats(limit=10):
+    """Returns the top functions of the aggregated cProfile stats by cumulative time"""
+    if _cprofile_stats is None:
+        return ""
+    with _cprofile_lock:
+        stream = io.StringIO()
+        _cprofile_stats.stream = stream
+        _cprofile_stats.sort_stats('cumulative').print_stats(limit)
+    return stream.getvalue()
+
+def save_perf_stats():
+    """Writes the aggregated timings to PROFILE_OUTPUT (and cProfile stats to PROFILE_OUTPUT.prof)"""
+    if not PROFILE_OUTPUT:
+        return
+    try:
+        with _perf_lock:
+            data = {'samples': _perf_samples, 'sample_rate': PROFILE_SAMPLE_RATE, 'phases': perf_stats}
+            write_json_atomic(PROFILE_OUTPUT, data)
+        if _cprofile_stats is not None:
+            with _cprofile_lock:
+                _cprofile_stats.dump_stats(f"{PROFILE_OUTPUT}.prof")
+    except Exception as e:
+        print(f"Error saving profiling stats: {e}")
+
+# Upstream calls run in worker threads: these cap how many are in flight at once
+_hyperliquid_slots = threading.BoundedSemaphore(HYPERLIQUID_MAX_CONCURRENCY)
+_vaults_analyser_slots = threading.BoundedSemaphore(VAULTS_ANALYSER_MAX_CONCURRENCY)
+
+class DataSource(ABC):
+    """Source of vault details, depositors and vault equities
+
+    Methods are blocking (they are called from worker threads) and return the
+    API payloads as parsed JSON, or None when the data is unavailable.
+    """
+    
+    @abstractmethod
+    def vault_details(self, vault_address):
+        """Returns the vaultDetails payload of a vault"""
+    
+    @abstractmethod
+    def depositors(self, vault_address):
+        """Returns the list of all depositors of a vault"""
+    
+    @abstractmethod
+    def vault_equities(self, wallet_address):
+        """Returns the vault equities of a wallet (raises on error)"""
+    
+    def prepare(self):
+        """Performs slow one-time setup (called by the startup warm-up)"""
+
+class LiveDataSource(DataSource):
+    """Hyperliquid API, vaults-analyser.com and the Hyperliquid SDK"""
+    
+    def __init__(self, hyperliquid_api=HYPERLIQUID_API, vaults_analyser_api=VAULTS_ANALYSER_API,
+                 vaults_analyser_token=VAULTS_ANALYSER_TOKEN, sdk_base_url=None):
+        self.hyperliquid_api = hyperliquid_api
+        self.vaults_analyser_api = vaults_analyser_api
+        self.vaults_analyser_token = vaults_analyser_token
+        self.sdk_base_url = sdk_base_url
+        self._info_client = None
+        self._info_lock = threading.Lock()
+    
+    def vault_details(self, vault_address):
+        """Retrieves vault data"""
+        try:
+            payload = {
+                "type": "vaultDetails",
+                "vaultAddress": vault_address
+            }
+            with _hyperliquid_slots:
+                response = requests.post(self.hyperliquid_api, json=payload, timeout=UPSTREAM_TIMEOUT)
+            response.raise_for_status()
             data = response.json()
-            if isinstance(data, dict) and "data" in data:
-                return data["data"]
-            elif isinstance(data, list):
-                return data
-            return []
-        elif response.status_code == 401:
-            print("vaults-analyser authentication error: Invalid or expired token")
+            return data
+        except requests.exceptions.RequestException as e:
+            print(f"Error retrieving vault data: {e}")
+            if hasattr(e, 'response') and e.response is not None:
+                print(f"Response status: {e.response.status_code}")
+                print(f"Response text: {e.response.text[:200]}")
             return None
-        elif response.status_code == 404:
-            print("Vault not found on vaults-analyser")
+        except Exception as e:
+            print(f"Error retrieving vault data: {e}")
             return None
-        else:
-            print(f"vaults-analyser API error: {response.status_code} - {response.text[:200]}")
+    
+    def depositors(self, vault_address):
+        """Retrieves the complete list of all vault depositors via vaults-analyser.com"""
+        if not self.vaults_analyser_token:
+            return None
+        
+        try:
+            url = f"{self.vaults_analyser_api}/depositors/{vault_address}"
+            headers = {
+                "Authorization": f"Bearer {self.vaults_analyser_token}",
+                "Content-Type": "application/json",
+                "Accept": "application/json"
+            }
+            
+            with _vaults_analyser_slots:
+                response = requests.get(url, headers=headers, timeout=UPSTREAM_TIMEOUT)
+            
+            if response.status_code == 200:
+                data = response.json()
+                if isinstance(data, dict) and "data" in data:
+                    return data["data"]
+                elif isinstance(data, list):
+                    return data
+                return []
+            elif response.status_code == 401:
+                print("vaults-analyser authentication error: Invalid or expired token")
+                return None
+            elif response.status_code == 404:
+                print("Vault not found on vaults-analyser")
+                return None
+            else:
+                print(f"vaults-analyser API error: {response.status_code} - {response.text[:200]}")
+                return None
+                
+        except requests.exceptions.RequestException as e:
+            print(f"Error retrieving depositors from vaults-analyser: {e}")
+            return None
+        except Exception as e:
+            print(f"Unexpected error: {e}")
             return None
+    
+    def info_client(self):
+        """Returns the Hyperliquid SDK Info client, created on first use (the SDK import and setup are slow)"""
+        with self._info_lock:
+            if self._info_client is None:
+                from hyperliquid.info import Info
+                from hyperliquid.utils import constants
+                self._info_client = Info(self.sdk_base_url or constants.MAINNET_API_URL, skip_ws=True, timeout=UPSTREAM_TIMEOUT)
+            return self._info_client
+    
+    def vault_equities(self, wallet_address):
+        """Retrieves the vault equities of a wallet with the Hyperliquid SDK"""
+        info = self.info_client()
+        with _hyperliquid_slots:
+            return info.user_vault_equities(wallet_address)
+    
+    def prepare(self):
+        """Sets up the SDK client"""
+        self.info_client()
+
+class CachedDataSource(DataSource):
+    """Reuses the responses of another source for a TTL
+
+    While fresh, the same objects are returned, so everything memoised per
+    snapshot (report header, returns, charts, depositor index) is reused.
+    Concurrent misses for the same key wait for a single upstream call.
+    Expired entries and their locks are evicted (at most once per TTL and kind),
+    so memory follows the wallets active within the TTL, not every wallet ever seen.
+    """
+    
+    def __init__(self, source, vault_ttl=VAULT_CACHE_TTL, depositors_ttl=DEPOSITORS_CACHE_TTL,
+                 equities_ttl=EQUITY_CACHE_TTL):
+        self.source = source
+        self.ttls = {
+            'vault_details': vault_ttl,
+            'depositors': depositors_ttl,
+            'vault_equities': equities_ttl
+        }
+        # kind -> key -> (fetched_at, value)
+        self.entries = {kind: {} for kind in self.ttls}
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+        # kind -> time of the next eviction of expired entries
+        self._next_prune = dict.fromkeys(self.ttls, 0.0)
+    
+    def _get(self, kind, key, fetch):
+        with self._locks_lock:
+            lock = self._locks.setdefault((kind, key), threading.Lock())
+        
+        with lock:
+            entry = self.entries[kind].get(key)
+            if entry is not None and time.time() - entry[0] < self.ttls[kind]:
+                return entry[1]
             
-    except requests.exceptions.RequestException as e:
-        print(f"Error retrieving depositors from vaults-analyser: {e}")
+            value = fetch(key)
+            now = time.time()
+            # Failures are not cached: the next call retries
+            if value is not None:
+                self.entries[kind][key] = (now, value)
+            if now >= self._next_prune[kind]:
+                self._prune(kind, now)
+            return value
+    
+    def _prune(self, kind, now):
+        """Evicts the expired entries of a kind and the locks nobody holds"""
+        entries = self.entries[kind]
+        ttl = self.ttls[kind]
+        with self._locks_lock:
+            self._next_prune[kind] = now + ttl
+            for key, (fetched_at, _) in list(entries.items()):
+                if now - fetched_at >= ttl:
+                    entries.pop(key, None)
+            for lock_key, lock in list(self._locks.items()):
+                if lock_key[0] == kind and lock_key[1] not in entries and not lock.locked():
+                    del self._locks[lock_key]
+    
+    def vault_details(self, vault_address):
+        return self._get('vault_details', vault_address, self.source.vault_details)
+    
+    def depositors(self, vault_address):
+        return self._get('depositors', vault_address, self.source.depositors)
+    
+    def vault_equities(self, wallet_address):
+        return self._get('vault_equities', wallet_address, self.source.vault_equities)
+    
+    def prepare(self):
+        self.source.prepare()
+    
+    def export_state(self):
+        """Returns the cached vault details and depositors as JSON-serialisable data"""
+        return {
+            kind: {key: list(entry) for key, entry in list(self.entries[kind].items())}
+            for kind in ('vault_details', 'depositors')
+        }
+    
+    def import_state(self, state):
+        """Restores entries exported by export_state (their TTL still applies)"""
+        for kind in ('vault_details', 'depositors'):
+            for key, (fetched_at, value) in (state.get(kind) or {}).items():
+                self.entries[kind][key] = (fetched_at, value)
+
+class FakeDataSource(DataSource):
+    """Fixture-backed source, to run the bot without network
+
+    The fixture is a JSON file (optionally gzipped) with 'vault_details',
+    'depositors' (list) and 'vault_equities' (wallet -> list) keys; replay
+    captures are accepted as well. Each call sleeps `latency` seconds and parses
+    a fresh copy of the payload, like a network round trip, and is counted in `calls`.
+    """
+    
+    def __init__(self, fixture_path, latency=0.0):
+        opener = gzip.open if fixture_path.endswith('.gz') else open
+        with opener(fixture_path, 'rt') as f:
+            fixture = json.load(f)
+        
+        equities = fixture.get('vault_equities')
+        if not isinstance(equities, dict):
+            # Replay capture: equities of the captured wallet only
+            equities = {fixture.get('wallet_address', ''): equities or []}
+        depositors = fixture.get('depositors')
+        if fixture.get('depositors_available') is False:
+            depositors = None
+        
+        self._payloads = {
+            'vault_details': json.dumps(fixture.get('vault_details')),
+            'depositors': json.dumps(depositors),
+            'vault_equities': {wallet.lower(): json.dumps(value) for wallet, value in equities.items()}
+        }
+        self.latency = latency
+        self.calls = Counter()
+        self._calls_lock = threading.Lock()
+    
+    def _respond(self, kind, payload):
+        with self._calls_lock:
+            self.calls[kind] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return json.loads(payload)
+    
+    def vault_details(self, vault_address):
+        return self._respond('vault_details', self._payloads['vault_details'])
+    
+    def depositors(self, vault_address):
+        return self._respond('depositors', self._payloads['depositors'])
+    
+    def vault_equities(self, wallet_address):
+        return self._respond('vault_equities', self._payloads['vault_equities'].get(wallet_address.lower(), '[]'))
+
+# Data source used by the bot, created on first use (see get_data_source)
+_data_source = None
+_data_source_lock = threading.Lock()
+
+def get_data_source():
+    """Returns the data source selected by DATA_SOURCE, wrapped in a CachedDataSource"""
+    global _data_source
+    with _data_source_lock:
+        if _data_source is None:
+            if DATA_SOURCE == 'live':
+                source = LiveDataSource()
+            elif DATA_SOURCE == 'fake':
+                if not FAKE_DATA_FILE:
+                    raise ValueError("FAKE_DATA_FILE environment variable is required when DATA_SOURCE=fake")
+                source = FakeDataSource(FAKE_DATA_FILE, latency=FAKE_LATENCY_MS / 1000)
+            else:
+                raise ValueError(f"Unknown DATA_SOURCE: {DATA_SOURCE} (expected 'live' or 'fake')")
+            _data_source = CachedDataSource(source)
+        return _data_source
+
+def set_data_source(source):
+    """Replaces the data source (e.g. with a FakeDataSource)"""
+    global _data_source
+    with _data_source_lock:
+        _data_source = source
+
+def get_vault_snapshot():
+    """Returns the HLP vault data (refreshed at most once every VAULT_CACHE_TTL seconds)
+
+    The same dict object is returned while the snapshot is fresh, so everything
+    cached per snapshot (report header, charts) is reused.
+    """
+    return get_data_source().vault_details(HLP_VAULT_ADDRESS)
+
+# Index of the last depositor list, rebuilt only when the data source refreshes the list
+_depositor_index_cache = {'depositors': None, 'index': None}
+_depositor_index_lock = threading.Lock()
+
+def get_depositor_index(vault_address):
+    """Returns the vault depositors as a dict lowercase address -> depositor"""
+    all_depositors = get_data_source().depositors(vault_address)
+    if all_depositors is None:
         return None
-    except Exception as e:
-        print(f"Unexpected error: {e}")
+    
+    with _depositor_index_lock:
+        if _depositor_index_cache['depositors'] is all_depositors:
+            return _depositor_index_cache['index']
+        
+        index = {}
+        for depositor in all_depositors:
+            if isinstance(depositor, dict) and depositor.get('user'):
+                index[depositor['user'].lower()] = depositor
+        
+        _depositor_index_cache['depositors'] = all_depositors
+        _depositor_index_cache['index'] = index
+        return index
+
+def get_vault_equities(wallet_address):
+    """Returns the SDK vault equities of a wallet (cached EQUITY_CACHE_TTL seconds per wallet)
+
+    Concurrent calls for the same wallet wait for a single request.
+    """
+    return get_data_source().vault_equities(wallet_address.lower())
+
+# Depositor arrays and distribution stats, recomputed only when the depositor index is refreshed.
+# Memo entries are (source object, value) tuples replaced as a whole, so a report thread
+# never pairs one snapshot with a value computed by another thread for another snapshot.
+_depositor_stats_cache = {'entry': None}
+
+def parse_amount(value):
+    """Converts an API amount (str or number) to float, 0 when missing or invalid"""
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return 0.0
+
+def get_depositor_stats(depositor_index):
+    """Returns vectorised depositor data and vault-wide stats for a depositor index
+
+    The result holds sorted equity/all-time PnL arrays for percentile lookups and
+    the distribution stats shown by /stats. It is memoised per index object.
+    """
+    entry = _depositor_stats_cache['entry']
+    if entry is not None and entry[0] is depositor_index:
+        return entry[1]
+    
+    import numpy as np
+    
+    count = len(depositor_index)
+    equity = np.fromiter(
+        (parse_amount(d.get('vault_equity')) for d in depositor_index.values()), dtype=float, count=count
+    )
+    all_time_pnl = np.fromiter(
+        (parse_amount(d.get('all_time_pnl')) for d in depositor_index.values()), dtype=float, count=count
+    )
+    deposits = equity - all_time_pnl
+    
+    sorted_equity = np.sort(equity)
+    total_equity = float(sorted_equity.sum())
+    positive_deposits = deposits[deposits > 0]
+    
+    stats = {
+        'count': count,
+        'sorted_equity': sorted_equity,
+        'sorted_all_time_pnl': np.sort(all_time_pnl),
+        'total_equity': total_equity,
+        'median_equity': float(np.median(equity)) if count else 0.0,
+        'median_deposit': float(np.median(positive_deposits)) if positive_deposits.size else 0.0,
+        'total_all_time_pnl': float(all_time_pnl.sum()),
+        'profitable_share': float((all_time_pnl > 0).mean() * 100) if count else 0.0,
+        'top100_share': float(sorted_equity[-100:].sum() / total_equity * 100) if total_equity > 0 else 0.0
+    }
+    _depositor_stats_cache['entry'] = (depositor_index, stats)
+    return stats
+
+def rank_in(sorted_values, value):
+    """Returns (rank, top percent) of a value among sorted values (rank 1 = highest)"""
+    import numpy as np
+    
+    count = len(sorted_values)
+    higher = count - int(np.searchsorted(sorted_values, value, side='right'))
+    rank = higher + 1
+    return rank, rank / count * 100
+
+def get_user_rank(wallet_address):
+    """Returns the rank of an address by equity and all-time PnL among all depositors
+
+    Returns None when depositor data is unavailable, {} when the address is not a depositor.
+    """
+    depositor_index = get_depositor_index(HLP_VAULT_ADDRESS)
+    if not depositor_index:
         return None
+    
+    depositor = depositor_index.get(wallet_address.lower())
+    if not depositor:
+        return {}
+    
+    stats = get_depositor_stats(depositor_index)
+    equity = parse_amount(depositor.get('vault_equity'))
+    all_time_pnl = parse_amount(depositor.get('all_time_pnl'))
+    equity_rank, equity_top = rank_in(stats['sorted_equity'], equity)
+    pnl_rank, pnl_top = rank_in(stats['sorted_all_time_pnl'], all_time_pnl)
+    
+    return {
+        'count': stats['count'],
+        'equity': equity,
+        'equity_rank': equity_rank,
+        'equity_top_percent': equity_top,
+        'all_time_pnl': all_time_pnl,
+        'pnl_rank': pnl_rank,
+        'pnl_top_percent': pnl_top
+    }
+
+_capture_lock = threading.Lock()
+
+def capture_report_inputs(vault_data, wallet_address, vault_equities, depositor_index):
+    """Saves the raw API data of a report to CAPTURE_DIR so it can be replayed
+
+    Only the wallet's own depositor entry is kept (the report uses nothing else),
+    and the oldest captures are deleted beyond CAPTURE_MAX_FILES / CAPTURE_MAX_BYTES.
+    """
+    wallet_address = wallet_address.lower()
+    captured_at = int(utc_now().timestamp() * 1000)
+    depositor = depositor_index.get(wallet_address) if depositor_index else None
+    capture = {
+        'captured_at': captured_at,
+        'wallet_address': wallet_address,
+        'vault_details': vault_data,
+        'vault_equities': vault_equities,
+        'depositors_available': depositor_index is not None,
+        'depositors': [depositor] if depositor else []
+    }
+    
+    try:
+        with _capture_lock:
+            os.makedirs(CAPTURE_DIR, exist_ok=True)
+            path = os.path.join(CAPTURE_DIR, f"capture-{captured_at}-{wallet_address}.json.gz")
+            write_json_atomic(path, capture, compress=True)
+            prune_captures()
+    except Exception as e:
+        print(f"Error capturing report data: {e}")
+
+def prune_captures():
+    """Deletes the oldest captures until the ring buffer fits its bounds"""
+    captures = [
+        entry for entry in os.scandir(CAPTURE_DIR)
+        if entry.name.startswith('capture-') and entry.name.endswith('.json.gz')
+    ]
+    # Names start with the capture timestamp: sorting by name is oldest first
+    captures.sort(key=lambda entry: entry.name)
+    sizes = [entry.stat().st_size for entry in captures]
+    total_bytes = sum(sizes)
+    
+    removed = 0
+    while captures[removed:] and (len(captures) - removed > CAPTURE_MAX_FILES or total_bytes > CAPTURE_MAX_BYTES):
+        os.remove(captures[removed].path)
+        total_bytes -= sizes[removed]
+        removed += 1
+
+def save_caches():
+    """Saves the cached vault details and depositors so a restart does not re-fetch them"""
+    try:
+        source = get_data_source()
+        if DATA_SOURCE != 'live' or not isinstance(source, CachedDataSource):
+            return
+        write_json_atomic(CACHE_FILE, source.export_state(), compress=True)
+    except Exception as e:
+        print(f"Error saving caches: {e}")
+
+def load_caches():
+    """Restores the caches saved by save_caches (their TTL still applies)"""
+    try:
+        source = get_data_source()
+        if DATA_SOURCE != 'live' or not isinstance(source, CachedDataSource) or not os.path.exists(CACHE_FILE):
+            return
+        with gzip.open(CACHE_FILE, 'rt') as f:
+            state = json.load(f)
+        # Files written by older versions have another layout: start cold
+        if 'vault_details' in state:
+            source.import_state(state)
+    except Exception as e:
+        print(f"Error loading caches: {e}")
+
+# Followers (top 100) of the last vault snapshot, indexed by lowercase address
+_follower_index_cache = {'entry': None}
+
+def get_follower_index(vault_data):
+    """Returns the vault followers as a dict lowercase address -> follower (memoised per snapshot)"""
+    entry = _follower_index_cache['entry']
+    if entry is not None and entry[0] is vault_data:
+        return entry[1]
+    
+    index = {}
+    followers = vault_data.get('followers', []) if isinstance(vault_data, dict) else []
+    if isinstance(followers, list):
+        for follower in followers:
+            if isinstance(follower, dict) and follower.get('user'):
+                index[follower['user'].lower()] = follower
+    
+    _follower_index_cache['entry'] = (vault_data, index)
+    return index
+
+def fetch_position_inputs(wallet_address):
+    """Fetches the raw data a position is computed from: (SDK vault equities, depositor index)"""
+    try:
+        vault_equities = get_vault_equities(wallet_address)
+    except Exception as e:
+        print(f"Hyperliquid SDK error: {e}")
+        vault_equities = None
+    return vault_equities, get_depositor_index(HLP_VAULT_ADDRESS)
 
 def get_user_vault_position(wallet_address, vault_data=None):
     """Retrieves your position in the HLP vault using Hyperliquid SDK"""
-    vault_address = "0xdfc24b077bc1425ad1dea75bcb6f8158e10df303"
+    vault_equities, depositor_index = fetch_position_inputs(wallet_address.lower())
+    return resolve_user_position(wallet_address, vault_data, vault_equities, depositor_index)
+
+def resolve_user_position(wallet_address, vault_data, vault_equities, depositor_index):
+    """Computes a position from already fetched data (no network access)"""
+    vault_address = HLP_VAULT_ADDRESS
+    wallet_address = wallet_address.lower()
     
-    # Use Hyperliquid SDK to get current value (most reliable method)
+    # Use Hyperliquid SDK value to get current value (most reliable method)
     equity_from_sdk = None
     locked_until = 0
     try:
-        info = Info(constants.MAINNET_API_URL, skip_ws=True)
-        vault_equities = info.user_vault_equities(wallet_address)
-        
         if isinstance(vault_equities, list):
             for vault_info in vault_equities:
                 if isinstance(vault_info, dict):
                     vault_addr = vault_info.get('vaultAddress', '')
-                    if vault_addr.lower() == vault_address.lower():
+                    if vault_addr.lower() == vault_address:
                         equity = vault_info.get('equity', '0')
                         try:
                             equity_from_sdk = float(equity) if isinstance(equity, str) else equity
@@ -140,63 +905,58 @@ def get_user_vault_position(wallet_address, vault_data=None):
         all_time_pnl_calculated = None
         
         # Try vaults-analyser first to get initial deposit
-        all_depositors = get_all_vault_depositors(vault_address)
-        if all_depositors:
-            print(f"DEBUG: Found {len(all_depositors)} depositors from vaults-analyser")
-            for depositor in all_depositors:
-                if isinstance(depositor, dict) and depositor.get('user', '').lower() == wallet_address.lower():
-                    print(f"DEBUG: Found user in vaults-analyser: {depositor}")
-                    vault_equity_va = depositor.get('vault_equity', None)
-                    all_time_pnl_va = depositor.get('all_time_pnl', None)
-                    print(f"DEBUG: vault_equity_va={vault_equity_va}, all_time_pnl_va={all_time_pnl_va}")
-                    if vault_equity_va is not None and all_time_pnl_va is not None:
-                        try:
-                            vault_equity_va = float(vault_equity_va) if isinstance(vault_equity_va, str) else vault_equity_va
-                            all_time_pnl_va = float(all_time_pnl_va) if isinstance(all_time_pnl_va, str) else all_time_pnl_va
-                            initial_deposit = vault_equity_va - all_time_pnl_va
-                            
-                            total_pnl_calculated = equity_from_sdk - initial_deposit
-                            
-                            print(f"DEBUG: Calculated initial_deposit={initial_deposit}, total_pnl_calculated={total_pnl_calculated}")
-                            
-                            return {
-                                'equity': equity_from_sdk,
-                                'lockedUntil': locked_until,
-                                'pnl': depositor.get('pnl', 0),
-                                'allTimePnl': total_pnl_calculated,
-                                'initialDeposit': initial_deposit
-                            }
-                        except (ValueError, TypeError) as e:
-                            print(f"Initial deposit calculation error: {e}")
-                    break
+        if depositor_index:
+            print(f"DEBUG: Found {len(depositor_index)} depositors from vaults-analyser")
+            depositor = depositor_index.get(wallet_address)
+            if depositor:
+                print(f"DEBUG: Found user in vaults-analyser: {depositor}")
+                vault_equity_va = depositor.get('vault_equity', None)
+                all_time_pnl_va = depositor.get('all_time_pnl', None)
+                print(f"DEBUG: vault_equity_va={vault_equity_va}, all_time_pnl_va={all_time_pnl_va}")
+                if vault_equity_va is not None and all_time_pnl_va is not None:
+                    try:
+                        vault_equity_va = float(vault_equity_va) if isinstance(vault_equity_va, str) else vault_equity_va
+                        all_time_pnl_va = float(all_time_pnl_va) if isinstance(all_time_pnl_va, str) else all_time_pnl_va
+                        initial_deposit = vault_equity_va - all_time_pnl_va
+                        
+                        total_pnl_calculated = equity_from_sdk - initial_deposit
+                        
+                        print(f"DEBUG: Calculated initial_deposit={initial_deposit}, total_pnl_calculated={total_pnl_calculated}")
+                        
+                        return {
+                            'equity': equity_from_sdk,
+                            'lockedUntil': locked_until,
+                            'pnl': depositor.get('pnl', 0),
+                            'allTimePnl': total_pnl_calculated,
+                            'initialDeposit': initial_deposit
+                        }
+                    except (ValueError, TypeError) as e:
+                        print(f"Initial deposit calculation error: {e}")
         else:
             print("DEBUG: No depositors found from vaults-analyser")
         
         # Try followers list (top 100) as fallback
         if initial_deposit is None and vault_data and isinstance(vault_data, dict):
-            followers = vault_data.get('followers', [])
-            if isinstance(followers, list):
-                for follower in followers:
-                    if isinstance(follower, dict) and follower.get('user', '').lower() == wallet_address.lower():
-                        vault_equity_f = follower.get('vaultEquity', None)
-                        all_time_pnl_f = follower.get('allTimePnl', None)
-                        if vault_equity_f is not None and all_time_pnl_f is not None:
-                            try:
-                                vault_equity_f = float(vault_equity_f) if isinstance(vault_equity_f, str) else vault_equity_f
-                                all_time_pnl_f = float(all_time_pnl_f) if isinstance(all_time_pnl_f, str) else all_time_pnl_f
-                                initial_deposit = vault_equity_f - all_time_pnl_f
-                                total_pnl_calculated = equity_from_sdk - initial_deposit
-                                
-                                return {
-                                    'equity': equity_from_sdk,
-                                    'lockedUntil': locked_until,
-                                    'pnl': follower.get('pnl', 0),
-                                    'allTimePnl': total_pnl_calculated,
-                                    'initialDeposit': initial_deposit
-                                }
-                            except (ValueError, TypeError):
-                                pass
-                        break
+            follower = get_follower_index(vault_data).get(wallet_address)
+            if follower:
+                vault_equity_f = follower.get('vaultEquity', None)
+                all_time_pnl_f = follower.get('allTimePnl', None)
+                if vault_equity_f is not None and all_time_pnl_f is not None:
+                    try:
+                        vault_equity_f = float(vault_equity_f) if isinstance(vault_equity_f, str) else vault_equity_f
+                        all_time_pnl_f = float(all_time_pnl_f) if isinstance(all_time_pnl_f, str) else all_time_pnl_f
+                        initial_deposit = vault_equity_f - all_time_pnl_f
+                        total_pnl_calculated = equity_from_sdk - initial_deposit
+                        
+                        return {
+                            'equity': equity_from_sdk,
+                            'lockedUntil': locked_until,
+                            'pnl': follower.get('pnl', 0),
+                            'allTimePnl': total_pnl_calculated,
+                            'initialDeposit': initial_deposit
+                        }
+                    except (ValueError, TypeError):
+                        pass
         
         # If initial deposit not found, return with equity anyway
         return {
@@ -209,45 +969,165 @@ def get_user_vault_position(wallet_address, vault_data=None):
     
     # Fallback 1: Search in followers list (top 100)
     if vault_data and isinstance(vault_data, dict):
-        followers = vault_data.get('followers', [])
-        if isinstance(followers, list):
-            for follower in followers:
-                if isinstance(follower, dict) and follower.get('user', '').lower() == wallet_address.lower():
-                    equity = follower.get('vaultEquity', '0')
-                    try:
-                        equity_float = float(equity) if isinstance(equity, str) else equity
-                        return {
-                            'equity': equity_float,
-                            'pnl': follower.get('pnl', 0),
-                            'allTimePnl': follower.get('allTimePnl', 0)
-                        }
-                    except (ValueError, TypeError):
-                        return {'equity': 0, 'pnl': 0, 'allTimePnl': 0}
+        follower = get_follower_index(vault_data).get(wallet_address)
+        if follower:
+            equity = follower.get('vaultEquity', '0')
+            try:
+                equity_float = float(equity) if isinstance(equity, str) else equity
+                return {
+                    'equity': equity_float,
+                    'pnl': follower.get('pnl', 0),
+                    'allTimePnl': follower.get('allTimePnl', 0)
+                }
+            except (ValueError, TypeError):
+                return {'equity': 0, 'pnl': 0, 'allTimePnl': 0}
     
     # Fallback 2: Try vaults-analyser (may not be up to date)
-    all_depositors = get_all_vault_depositors(vault_address)
-    if all_depositors:
-        for depositor in all_depositors:
-            if isinstance(depositor, dict) and depositor.get('user', '').lower() == wallet_address.lower():
-                vault_equity = depositor.get('vault_equity', 0)
-                try:
-                    equity_float = float(vault_equity) if isinstance(vault_equity, str) else vault_equity
-                    return {
-                        'equity': equity_float,
-                        'pnl': depositor.get('pnl', 0),
-                        'allTimePnl': depositor.get('all_time_pnl', 0)
-                    }
-                except (ValueError, TypeError):
-                    pass
+    if depositor_index:
+        depositor = depositor_index.get(wallet_address)
+        if depositor:
+            vault_equity = depositor.get('vault_equity', 0)
+            try:
+                equity_float = float(vault_equity) if isinstance(vault_equity, str) else vault_equity
+                return {
+                    'equity': equity_float,
+                    'pnl': depositor.get('pnl', 0),
+                    'allTimePnl': depositor.get('all_time_pnl', 0)
+                }
+            except (ValueError, TypeError):
+                pass
     
     return None
 
+def get_portfolio_period(vault_data, period):
+    """Returns the portfolio data of a period ('day', 'week', 'month', 'allTime')"""
+    if not vault_data or not isinstance(vault_data, dict):
+        return None
+    for period_data in vault_data.get('portfolio', []):
+        if (isinstance(period_data, list) and len(period_data) >= 2 and
+            period_data[0] == period and isinstance(period_data[1], dict)):
+            return period_data[1]
+    return None
+
+MS_PER_DAY = 1000 * 60 * 60 * 24
+
+def history_to_arrays(account_history, pnl_history):
+    """Converts accountValueHistory and pnlHistory to numpy arrays aligned on common timestamps"""
+    import numpy as np
+    
+    def to_array(history):
+        points = [(entry[0], float(entry[1])) for entry in history if isinstance(entry, list) and len(entry) >= 2]
+        return np.array(points, dtype=float).reshape(-1, 2)
+    
+    account_values = to_array(account_history)
+    pnls = to_array(pnl_history)
+    times, account_idx, pnl_idx = np.intersect1d(account_values[:, 0], pnls[:, 0], return_indices=True)
+    return times, account_values[account_idx, 1], pnls[pnl_idx, 1]
+
+def compute_time_weighted_returns(period_info):
+    """Computes the time-weighted return index of a portfolio period
+
+    Each interval's return is its PnL change divided by the account value at its
+    start, so deposits and withdrawals do not count as performance.
+    Returns (timestamps in ms, cumulative index starting at 1) or None.
+    """
+    import numpy as np
+    
+    times, account_values, pnls = history_to_arrays(
+        period_info.get('accountValueHistory', []),
+        period_info.get('pnlHistory', [])
+    )
+    if len(times) < 2:
+        return None
+    
+    start_values = account_values[:-1]
+    pnl_changes = np.diff(pnls)
+    interval_returns = np.divide(pnl_changes, start_values, out=np.zeros_like(pnl_changes), where=start_values > 0)
+    index = np.concatenate(([1.0], np.cumprod(1 + interval_returns)))
+    return times, index
+
+def annualised_return(times, index, window_days=None):
+    """Annualised return (%) of a return index over its last window_days (whole series when None)
+
+    Returns None when the series does not cover the requested window.
+    """
+    import numpy as np
+    
+    start = 0
+    if window_days is not None:
+        if times[-1] - times[0] < window_days * MS_PER_DAY * 0.95:
+            return None
+        start = int(np.searchsorted(times, times[-1] - window_days * MS_PER_DAY))
+    
+    days = (times[-1] - times[start]) / MS_PER_DAY
+    if days <= 0 or index[start] <= 0:
+        return None
+    total_return_percent = (index[-1] / index[start] - 1) * 100
+    return (total_return_percent / days) * 365
+
+def max_drawdown(index):
+    """Largest peak-to-trough decline (%) of a return index, as a negative number"""
+    import numpy as np
+    
+    return float((index / np.maximum.accumulate(index) - 1).min() * 100)
+
+# Returns computed from the last vault snapshot (see get_vault_returns)
+_returns_cache = {'entry': None}
+
+def get_vault_returns(vault_data):
+    """Computes time-weighted returns, rolling 7d/30d APR and max drawdown of the vault
+
+    Memoised per vault_data object: runs once per data refresh however many reports use it.
+    """
+    entry = _returns_cache['entry']
+    if entry is not None and entry[0] is vault_data:
+        return entry[1]
+    
+    returns = {
+        'twr_all_time': None,
+        'apr': None,
+        'apr_7d': None,
+        'apr_30d': None,
+        'max_drawdown': None
+    }
+    
+    try:
+        series = {}
+        for period in ('week', 'month', 'allTime'):
+            period_info = get_portfolio_period(vault_data, period)
+            twr = compute_time_weighted_returns(period_info) if period_info else None
+            if twr:
+                series[period] = twr
+        
+        if 'allTime' in series:
+            times, index = series['allTime']
+            returns['twr_all_time'] = float((index[-1] - 1) * 100)
+            returns['apr'] = annualised_return(times, index)
+            returns['max_drawdown'] = max_drawdown(index)
+        
+        # Use the finest series covering each window
+        for key, window_days in (('apr_7d', 7), ('apr_30d', 30)):
+            for period in ('week', 'month', 'allTime'):
+                if period in series:
+                    apr = annualised_return(*series[period], window_days=window_days)
+                    if apr is not None:
+                        returns[key] = apr
+                        break
+    except Exception as e:
+        print(f"Error computing vault returns: {e}")
+    
+    _returns_cache['entry'] = (vault_data, returns)
+    return returns
+
 def extract_vault_metrics(vault_data):
     """Extracts vault metrics from API data (rolling 24h)"""
     metrics = {
         'tvl': 0,
         'daily_pnl_percent': 0,
-        'apr': 0
+        'apr': 0,
+        'apr_7d': None,
+        'apr_30d': None,
+        'max_drawdown': None
     }
     
     try:
@@ -340,6 +1220,15 @@ def extract_vault_metrics(vault_data):
     except Exception as e:
         print(f"Error extracting metrics: {e}")
     
+    # Time-weighted returns take deposits/withdrawals into account: prefer them
+    # over the first/last point approximation above
+    returns = get_vault_returns(vault_data)
+    if returns['apr'] is not None:
+        metrics['apr'] = returns['apr']
+    metrics['apr_7d'] = returns['apr_7d']
+    metrics['apr_30d'] = returns['apr_30d']
+    metrics['max_drawdown'] = returns['max_drawdown']
+    
     return metrics
 
 def extract_yesterday_vault_metrics(vault_data):
@@ -354,7 +1243,7 @@ def extract_yesterday_vault_metrics(vault_data):
     
     try:
         # Get yesterday's date range (00:00 to 23:59:59) in UTC
-        now = datetime.now(timezone.utc)
+        now = utc_now()
         yesterday_date = (now - timedelta(days=1)).date()
         
         yesterday_start = datetime.combine(
@@ -491,28 +1380,119 @@ def extract_yesterday_vault_metrics(vault_data):
     
     return metrics
 
-def format_performance_message(vault_data, user_data, user_pnl, user_pnl_percent, yesterday_metrics=None):
-    """Formats the performance message"""
-    today = datetime.now().strftime("%m/%d/%Y")
-    yesterday = (datetime.now() - timedelta(days=1)).strftime("%m/%d/%Y")
+# Vault-wide report headers of the last vault snapshot: (vault_data, {(day, use_yesterday): header})
+_report_header_cache = {'entry': None}
+
+def render_vault_header(vault_data, yesterday_metrics=None, vault_metrics=None):
+    """Renders the vault-wide part of the report (identical for every user)
+
+    Returns a dict with the rendered HTML and the PnL label of the position block.
+    The result is cached for as long as the same vault_data object is passed in.
+    """
+    use_yesterday = bool(yesterday_metrics and yesterday_metrics.get('yesterday_pnl_percent', 0) != 0)
+    today = local_now().strftime("%m/%d/%Y")
+    
+    entry = _report_header_cache['entry']
+    if entry is None or entry[0] is not vault_data:
+        entry = (vault_data, {})
+        _report_header_cache['entry'] = entry
+    headers = entry[1]
+    
+    cache_key = (today, use_yesterday)
+    header = headers.get(cache_key)
+    if header is not None:
+        return header
+    
+    if vault_metrics is None:
+        vault_metrics = extract_vault_metrics(vault_data)
     
     # Use yesterday metrics if available
-    if yesterday_metrics and yesterday_metrics.get('yesterday_pnl_percent', 0) != 0:
+    if use_yesterday:
+        yesterday = (local_now() - timedelta(days=1)).strftime("%m/%d/%Y")
         vault_pnl_percent = yesterday_metrics.get('yesterday_pnl_percent', 0)
         vault_tvl = yesterday_metrics.get('tvl', 0)
         period_label = f"Yesterday ({yesterday})"
     else:
         # Fallback to rolling 24h
-        vault_metrics = extract_vault_metrics(vault_data)
         vault_pnl_percent = vault_metrics['daily_pnl_percent']
         vault_tvl = vault_metrics['tvl']
         period_label = "Last 24h (Rolling)"
     
     vault_emoji = "📈" if vault_pnl_percent > 0 else "📉"
-    user_emoji = "✅" if user_pnl > 0 else "❌" if user_pnl < 0 else "➖"
-    
     tvl_str = f"${vault_tvl:,.2f}" if vault_tvl > 0 else "N/A"
     
+    returns_lines = ""
+    apr_parts = [
+        f"{label} {vault_metrics[key]:.2f}%"
+        for key, label in (('apr_7d', '7d'), ('apr_30d', '30d'))
+        if vault_metrics.get(key) is not None
+    ]
+    if apr_parts:
+        returns_lines += f"• APR: {' | '.join(apr_parts)}\n"
+    if vault_metrics.get('max_drawdown') is not None:
+        returns_lines += f"• Max Drawdown: {vault_metrics['max_drawdown']:.2f}%\n"
+    
+    html = f"""
+<b>🏦 HLP Vault Performance - {today}</b>
+
+<b>📊 Global Vault ({period_label}):</b>
+• TVL: {tvl_str}
+• Performance: {vault_emoji} {vault_pnl_percent:.2f}%
+{returns_lines}
+"""
+    header = {
+        'html': html,
+        'pnl_label': "Yesterday PnL" if use_yesterday else "24h PnL"
+    }
+    headers[cache_key] = header
+    return header
+
+def format_total_pnl(user_equity, all_time_pnl, initial_deposit):
+    """Formats the Total PnL line of the position block"""
+    # Calculate Total PnL: same method as v1
+    # Priority: use allTimePnl if available, otherwise calculate from current_value - initialDeposit
+    if all_time_pnl is not None and initial_deposit is not None and initial_deposit > 0:
+        try:
+            all_time_pnl = float(all_time_pnl) if isinstance(all_time_pnl, str) else all_time_pnl
+            initial_deposit = float(initial_deposit) if isinstance(initial_deposit, str) else initial_deposit
+            
+            all_time_pnl_percent = (all_time_pnl / initial_deposit) * 100
+            total_pnl_emoji = "✅" if all_time_pnl > 0 else "❌" if all_time_pnl < 0 else "➖"
+            return f"{total_pnl_emoji} ${all_time_pnl:,.2f} ({all_time_pnl_percent:+.2f}%)"
+        except (ValueError, TypeError) as e:
+            print(f"DEBUG: Error formatting total PnL with deposit: {e}")
+            return "N/A"
+    elif all_time_pnl is not None:
+        try:
+            all_time_pnl = float(all_time_pnl) if isinstance(all_time_pnl, str) else all_time_pnl
+            # Show Total PnL even if zero
+            total_pnl_emoji = "✅" if all_time_pnl > 0 else "❌" if all_time_pnl < 0 else "➖"
+            return f"{total_pnl_emoji} ${all_time_pnl:,.2f}"
+        except (ValueError, TypeError) as e:
+            print(f"DEBUG: Error formatting total PnL without deposit: {e}")
+            return "N/A"
+    elif initial_deposit is not None and user_equity > 0:
+        # Fallback: calculate Total PnL from current_value - initialDeposit (same as v1)
+        try:
+            initial_deposit = float(initial_deposit) if isinstance(initial_deposit, str) else initial_deposit
+            calculated_total_pnl = user_equity - initial_deposit
+            total_pnl_emoji = "✅" if calculated_total_pnl > 0 else "❌" if calculated_total_pnl < 0 else "➖"
+            print(f"DEBUG: Calculated Total PnL from current_value - initialDeposit: {calculated_total_pnl}")
+            if initial_deposit > 0:
+                calculated_total_pnl_percent = (calculated_total_pnl / initial_deposit) * 100
+                return f"{total_pnl_emoji} ${calculated_total_pnl:,.2f} ({calculated_total_pnl_percent:+.2f}%)"
+            return f"{total_pnl_emoji} ${calculated_total_pnl:,.2f}"
+        except (ValueError, TypeError) as e:
+            print(f"DEBUG: Error calculating total PnL from deposit: {e}")
+            return "N/A"
+    
+    print(f"DEBUG: all_time_pnl is None and cannot calculate from initialDeposit")
+    return "N/A"
+
+def render_user_position(user_data, user_pnl, user_pnl_percent, pnl_label):
+    """Renders the per-user "Your Position" block of the report"""
+    user_emoji = "✅" if user_pnl > 0 else "❌" if user_pnl < 0 else "➖"
+    
     if user_data and isinstance(user_data, dict):
         user_equity = user_data.get('equity', 0)
         if isinstance(user_equity, str):
@@ -528,78 +1508,66 @@ def format_performance_message(vault_data, user_data, user_pnl, user_pnl_percent
         # Debug logging
         print(f"DEBUG format_performance_message: user_equity={user_equity}, all_time_pnl={all_time_pnl}, initial_deposit={initial_deposit}")
         
-        # Calculate Total PnL: same method as v1
-        # Priority: use allTimePnl if available, otherwise calculate from current_value - initialDeposit
-        if all_time_pnl is not None and initial_deposit is not None and initial_deposit > 0:
-            try:
-                all_time_pnl = float(all_time_pnl) if isinstance(all_time_pnl, str) else all_time_pnl
-                initial_deposit = float(initial_deposit) if isinstance(initial_deposit, str) else initial_deposit
-                
-                all_time_pnl_percent = (all_time_pnl / initial_deposit) * 100
-                total_pnl_emoji = "✅" if all_time_pnl > 0 else "❌" if all_time_pnl < 0 else "➖"
-                total_pnl_str = f"{total_pnl_emoji} ${all_time_pnl:,.2f} ({all_time_pnl_percent:+.2f}%)"
-            except (ValueError, TypeError) as e:
-                print(f"DEBUG: Error formatting total PnL with deposit: {e}")
-                total_pnl_str = "N/A"
-        elif all_time_pnl is not None:
-            try:
-                all_time_pnl = float(all_time_pnl) if isinstance(all_time_pnl, str) else all_time_pnl
-                # Show Total PnL even if zero
-                total_pnl_emoji = "✅" if all_time_pnl > 0 else "❌" if all_time_pnl < 0 else "➖"
-                total_pnl_str = f"{total_pnl_emoji} ${all_time_pnl:,.2f}"
-            except (ValueError, TypeError) as e:
-                print(f"DEBUG: Error formatting total PnL without deposit: {e}")
-                total_pnl_str = "N/A"
-        elif initial_deposit is not None and user_equity > 0:
-            # Fallback: calculate Total PnL from current_value - initialDeposit (same as v1)
-            try:
-                initial_deposit = float(initial_deposit) if isinstance(initial_deposit, str) else initial_deposit
-                calculated_total_pnl = user_equity - initial_deposit
-                if initial_deposit > 0:
-                    calculated_total_pnl_percent = (calculated_total_pnl / initial_deposit) * 100
-                    total_pnl_emoji = "✅" if calculated_total_pnl > 0 else "❌" if calculated_total_pnl < 0 else "➖"
-                    total_pnl_str = f"{total_pnl_emoji} ${calculated_total_pnl:,.2f} ({calculated_total_pnl_percent:+.2f}%)"
-                else:
-                    total_pnl_emoji = "✅" if calculated_total_pnl > 0 else "❌" if calculated_total_pnl < 0 else "➖"
-                    total_pnl_str = f"{total_pnl_emoji} ${calculated_total_pnl:,.2f}"
-                print(f"DEBUG: Calculated Total PnL from current_value - initialDeposit: {calculated_total_pnl}")
-            except (ValueError, TypeError) as e:
-                print(f"DEBUG: Error calculating total PnL from deposit: {e}")
-                total_pnl_str = "N/A"
-        else:
-            print(f"DEBUG: all_time_pnl is None and cannot calculate from initialDeposit")
-            total_pnl_str = "N/A"
+        total_pnl_str = format_total_pnl(user_equity, all_time_pnl, initial_deposit)
+        not_found_str = ""
     else:
         equity_str = "N/A"
         total_pnl_str = "N/A"
+        not_found_str = "\n\n⚠️ Position not found. Please verify that your address is correct and that you have funds in the HLP vault."
     
-    pnl_label = "Yesterday PnL" if yesterday_metrics and yesterday_metrics.get('yesterday_pnl_percent', 0) != 0 else "24h PnL"
-    
-    message = f"""
-<b>🏦 HLP Vault Performance - {today}</b>
+    return (
+        "<b>💼 Your Position:</b>\n"
+        f"• Current Value: {equity_str}\n"
+        f"• {pnl_label}: {user_emoji} ${user_pnl:,.2f} ({user_pnl_percent:+.2f}%)\n"
+        f"• Total PnL: {total_pnl_str}{not_found_str}\n"
+    )
 
-<b>📊 Global Vault ({period_label}):</b>
-• TVL: {tvl_str}
-• Performance: {vault_emoji} {vault_pnl_percent:.2f}%
+def format_performance_message(vault_data, user_data, user_pnl, user_pnl_percent, yesterday_metrics=None, vault_metrics=None):
+    """Formats the performance message (cached vault header + per-user position block)"""
+    header = render_vault_header(vault_data, yesterday_metrics, vault_metrics)
+    return header['html'] + render_user_position(user_data, user_pnl, user_pnl_percent, header['pnl_label'])
 
-<b>💼 Your Position:</b>
-• Current Value: {equity_str}
-• {pnl_label}: {user_emoji} ${user_pnl:,.2f} ({user_pnl_percent:+.2f}%)
-• Total PnL: {total_pnl_str}{("" if user_data else "\n\n⚠️ Position not found. Please verify that your address is correct and that you have funds in the HLP vault.")}
-"""
-    return message
+# Last prepared snapshot as (vault_data, UTC day, snapshot), reused while the vault data and the UTC day are unchanged
+_snapshot_cache = {'entry': None}
 
-async def generate_report(wallet_address):
-    """Generates a report for a given address"""
-    vault_data = get_hlp_vault_performance()
-    
-    if not vault_data:
-        return "⚠️ Error retrieving vault data"
-    
-    user_data = get_user_vault_position(wallet_address, vault_data)
+def prepare_vault_snapshot(vault_data):
+    """Computes the vault-wide metrics shared by every report built from the same vault data"""
+    day = utc_now().date()
+    entry = _snapshot_cache['entry']
+    if entry is not None and entry[0] is vault_data and entry[1] == day:
+        return entry[2]
     
     # Get yesterday's metrics (calendar day)
     yesterday_metrics = extract_yesterday_vault_metrics(vault_data)
+    if yesterday_metrics.get('yesterday_pnl_percent', 0) == 0:
+        yesterday_metrics = None  # Mark as unavailable
+    
+    snapshot = {
+        'vault_data': vault_data,
+        'vault_metrics': extract_vault_metrics(vault_data),
+        'yesterday_metrics': yesterday_metrics
+    }
+    _snapshot_cache['entry'] = (vault_data, day, snapshot)
+    return snapshot
+
+def build_user_report(snapshot, wallet_address):
+    """Builds the report of one address from a prepared vault snapshot"""
+    with perf_phase('upstream'):
+        vault_equities, depositor_index = fetch_position_inputs(wallet_address.lower())
+    
+    if CAPTURE_DIR:
+        capture_report_inputs(snapshot['vault_data'], wallet_address, vault_equities, depositor_index)
+    
+    return render_report(snapshot, wallet_address, vault_equities, depositor_index)
+
+def render_report(snapshot, wallet_address, vault_equities, depositor_index):
+    """Renders the report of one address from already fetched data (no network access)"""
+    vault_data = snapshot['vault_data']
+    vault_metrics = snapshot['vault_metrics']
+    yesterday_metrics = snapshot['yesterday_metrics']
+    
+    with perf_phase('parsing'):
+        user_data = resolve_user_position(wallet_address, vault_data, vault_equities, depositor_index)
     
     # Calculate user's PnL for yesterday
     if user_data and isinstance(user_data, dict):
@@ -614,7 +1582,7 @@ async def generate_report(wallet_address):
     
     # Calculate yesterday's PnL
     # Use yesterday's vault performance to estimate user's PnL
-    if yesterday_metrics.get('yesterday_pnl_percent', 0) != 0:
+    if yesterday_metrics:
         # Use yesterday's vault performance percentage
         user_yesterday_pnl_percent = yesterday_metrics['yesterday_pnl_percent']
         
@@ -625,8 +1593,7 @@ async def generate_report(wallet_address):
         vault_yesterday_end = yesterday_metrics.get('yesterday_end_value', 0)
         
         # Get current vault TVL
-        vault_metrics_current = extract_vault_metrics(vault_data)
-        vault_current = vault_metrics_current.get('tvl', 0)
+        vault_current = vault_metrics.get('tvl', 0)
         
         if current_value > 0 and vault_yesterday_end > 0 and vault_current > 0:
             # Estimate user's position value at end of yesterday
@@ -652,18 +1619,277 @@ async def generate_report(wallet_address):
             user_yesterday_pnl = 0
     else:
         # Fallback: use rolling 24h metrics if yesterday data not available
-        vault_metrics = extract_vault_metrics(vault_data)
         user_yesterday_pnl = current_value * (vault_metrics['daily_pnl_percent'] / 100) if current_value > 0 else 0
         user_yesterday_pnl_percent = vault_metrics['daily_pnl_percent']
-        yesterday_metrics = None  # Mark as unavailable
     
-    message = format_performance_message(
-        vault_data, 
-        user_data, 
-        user_yesterday_pnl, 
-        user_yesterday_pnl_percent,
-        yesterday_metrics=yesterday_metrics
-    )
+    with perf_phase('formatting'):
+        message = format_performance_message(
+            vault_data, 
+            user_data, 
+            user_yesterday_pnl, 
+            user_yesterday_pnl_percent,
+            yesterday_metrics=yesterday_metrics,
+            vault_metrics=vault_metrics
+        )
+    return message
+
+async def generate_report(wallet_address):
+    """Generates a report for a given address"""
+    with perf_phase('upstream'):
+        vault_data = await asyncio.to_thread(get_vault_snapshot)
+    
+    if not vault_data:
+        return "⚠️ Error retrieving vault data"
+    
+    with perf_phase('parsing'):
+        snapshot = await asyncio.to_thread(run_profiled, prepare_vault_snapshot, vault_data)
+    message = await asyncio.to_thread(run_profiled, build_user_report, snapshot, wallet_address)
+    
+    remember_report(wallet_address, message)
+    return message
+
+# Last report built for each wallet: wallet -> (time.monotonic() when built, message), used by inline mode
+last_reports = OrderedDict()
+
+def remember_report(wallet_address, message):
+    """Keeps the last report of a wallet (least recently built ones are dropped)"""
+    last_reports[wallet_address] = (time.monotonic(), message)
+    last_reports.move_to_end(wallet_address)
+    while len(last_reports) > LAST_REPORT_CACHE_SIZE:
+        last_reports.popitem(last=False)
+
+async def generate_reports(wallet_addresses, concurrency=BROADCAST_WORKERS):
+    """Generates reports for several addresses from a single vault snapshot (report broadcasts)
+
+    Returns a dict address -> message (None when that report failed), or None when
+    the vault data is unavailable. The vault section is rendered once and only the
+    position block is built per distinct address, at most `concurrency` at a time
+    so interactive reports keep worker threads.
+    """
+    wallet_addresses = list(dict.fromkeys(address.lower() for address in wallet_addresses))
+    vault_data = await asyncio.to_thread(get_vault_snapshot)
+    
+    if not vault_data:
+        return None
+    
+    snapshot = await asyncio.to_thread(prepare_vault_snapshot, vault_data)
+    slots = asyncio.Semaphore(concurrency)
+    
+    async def build(address):
+        async with slots:
+            sample_profile()
+            try:
+                return await asyncio.to_thread(run_profiled, build_user_report, snapshot, address)
+            except Exception as e:
+                print(f"Error generating report for {address}: {e}")
+                return None
+            finally:
+                await finish_profile()
+    
+    messages = await asyncio.gather(*(build(address) for address in wallet_addresses))
+    return dict(zip(wallet_addresses, messages))
+
+# Report token buckets: user_id -> [tokens, last refill time]
+_report_buckets = {}
+
+def take_report_token(user_id):
+    """Consumes one report token of a user
+
+    Returns 0 when the report is allowed, otherwise the number of seconds to wait.
+    """
+    now = time.monotonic()
+    tokens, last_refill = _report_buckets.get(user_id, (REPORT_BURST, now))
+    tokens = min(REPORT_BURST, tokens + (now - last_refill) * REPORT_RATE_PER_MINUTE / 60)
+    
+    if tokens < 1:
+        _report_buckets[user_id] = [tokens, now]
+        return (1 - tokens) * 60 / REPORT_RATE_PER_MINUTE
+    
+    _report_buckets[user_id] = [tokens - 1, now]
+    return 0
+
+def rate_limited_text(retry_after):
+    """Message shown to a user who exceeded the report rate limit"""
+    return f"⏳ Too many requests, please try again in {math.ceil(retry_after)}s"
+
+# Fair report scheduling: jobs are served by REPORT_WORKERS workers, users whose
+# last report is the oldest first. Requests for the same wallet (from one or several
+# users) share the pending job.
+_report_queue = None
+_report_workers = []
+_pending_reports = {}
+_report_seq = itertools.count()
+
+# user_id -> time.monotonic() of the last report generated for that user
+last_report_at = {}
+
+async def report_worker():
+    """Generates queued reports, forever"""
+    while True:
+        _, _, wallet_address, future, timings = await _report_queue.get()
+        # Phases are timed for the request that queued the job
+        _perf_report.set(timings)
+        try:
+            message = await generate_report(wallet_address)
+            if not future.done():
+                future.set_result(message)
+        except Exception as e:
+            print(f"Error generating report: {e}")
+            if not future.done():
+                future.set_result("⚠️ Error generating report, please try again later")
+        finally:
+            _pending_reports.pop(wallet_address, None)
+            _report_queue.task_done()
+
+def start_report_workers():
+    """Creates the report queue and starts its workers (needs a running event loop)"""
+    global _report_queue
+    _report_queue = asyncio.PriorityQueue()
+    for _ in range(REPORT_WORKERS):
+        _report_workers.append(asyncio.get_running_loop().create_task(report_worker()))
+
+def stop_report_workers():
+    """Cancels the report workers"""
+    for worker in _report_workers:
+        worker.cancel()
+    _report_workers.clear()
+
+def enqueue_report(user_id, wallet_address):
+    """Queues a report, or joins the pending one of the same wallet, and returns its future"""
+    future = _pending_reports.get(wallet_address)
+    if future is None:
+        future = asyncio.get_running_loop().create_future()
+        _pending_reports[wallet_address] = future
+        # Users never served (0) or served longest ago come out first
+        priority = last_report_at.get(user_id, 0)
+        _report_queue.put_nowait((priority, next(_report_seq), wallet_address, future, _perf_report.get()))
+    return future
+
+async def request_report(user_id, wallet_address):
+    """Queues a report and waits for it"""
+    if _report_queue is None:
+        return await generate_report(wallet_address)
+    
+    future = enqueue_report(user_id, wallet_address)
+    try:
+        return await asyncio.shield(future)
+    finally:
+        last_report_at[user_id] = time.monotonic()
+
+# Process pool used to render charts off the event loop
+_chart_pool = None
+
+# Rendered charts: (period, snapshot timestamp) -> {'png': bytes, 'file_id': str or None}
+chart_cache = OrderedDict()
+
+# Key of the most recent chart rendered for each period
+latest_chart_keys = {}
+
+# Renders in progress, so concurrent requests for the same chart share one job
+_chart_renders = {}
+
+def render_chart_png(period, account_history, pnl_history):
+    """Renders the TVL and PnL chart of a period as PNG bytes (runs in a worker process)"""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    
+    def to_points(history):
+        times, values = [], []
+        for entry in history:
+            if isinstance(entry, list) and len(entry) >= 2:
+                times.append(datetime.fromtimestamp(entry[0] / 1000, timezone.utc))
+                values.append(float(entry[1]))
+        return times, values
+    
+    tvl_times, tvl_values = to_points(account_history)
+    pnl_times, pnl_values = to_points(pnl_history)
+    
+    fig, (ax_tvl, ax_pnl) = plt.subplots(2, 1, figsize=(8, 6), sharex=True)
+    ax_tvl.plot(tvl_times, tvl_values, color='#1f77b4')
+    ax_tvl.set_title(f"HLP Vault - {period}")
+    ax_tvl.set_ylabel("TVL ($)")
+    ax_tvl.grid(alpha=0.3)
+    ax_pnl.plot(pnl_times, pnl_values, color='#2ca02c')
+    ax_pnl.axhline(0, color='grey', linewidth=0.8)
+    ax_pnl.set_ylabel("PnL ($)")
+    ax_pnl.grid(alpha=0.3)
+    fig.autofmt_xdate()
+    fig.tight_layout()
+    
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png', dpi=100)
+    plt.close(fig)
+    return buffer.getvalue()
+
+def get_chart_pool():
+    """Returns the chart rendering process pool, creating it on first use"""
+    global _chart_pool
+    if _chart_pool is None:
+        # spawn: forking a process that already runs the event loop threads is unsafe
+        _chart_pool = ProcessPoolExecutor(
+            max_workers=CHART_WORKERS,
+            mp_context=multiprocessing.get_context('spawn')
+        )
+    return _chart_pool
+
+def shutdown_chart_pool():
+    """Stops the chart rendering processes"""
+    global _chart_pool
+    if _chart_pool is not None:
+        _chart_pool.shutdown(wait=False, cancel_futures=True)
+        _chart_pool = None
+
+async def get_chart(vault_data, period):
+    """Returns the chart cache entry of a period, rendering it in the process pool if needed
+
+    Charts are keyed by (period, last history timestamp) so the same vault snapshot
+    is only rendered (and uploaded) once.
+    """
+    period_info = get_portfolio_period(vault_data, period)
+    if not period_info:
+        return None
+    account_history = period_info.get('accountValueHistory', [])
+    pnl_history = period_info.get('pnlHistory', [])
+    if not account_history:
+        return None
+    
+    key = (period, account_history[-1][0])
+    entry = chart_cache.get(key)
+    if entry is not None:
+        chart_cache.move_to_end(key)
+        return entry
+    
+    render = _chart_renders.get(key)
+    if render is None:
+        loop = asyncio.get_running_loop()
+        render = loop.run_in_executor(get_chart_pool(), render_chart_png, period, account_history, pnl_history)
+        _chart_renders[key] = render
+    try:
+        png = await render
+    except Exception as e:
+        print(f"Error rendering chart: {e}")
+        return None
+    finally:
+        _chart_renders.pop(key, None)
+    
+    entry = chart_cache.get(key)
+    if entry is None:
+        entry = {'png': png, 'file_id': None}
+        chart_cache[key] = entry
+        while len(chart_cache) > CHART_CACHE_SIZE:
+            chart_cache.popitem(last=False)
+        if key >= latest_chart_keys.get(period, key):
+            latest_chart_keys[period] = key
+    return entry
+
+async def send_chart(bot, chat_id, entry, caption=None):
+    """Sends a chart, by file_id when it was already uploaded"""
+    if entry['file_id']:
+        return await bot.send_photo(chat_id=chat_id, photo=entry['file_id'], caption=caption)
+    message = await bot.send_photo(chat_id=chat_id, photo=entry['png'], caption=caption)
+    if message.photo:
+        entry['file_id'] = message.photo[-1].file_id
     return message
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -698,10 +1924,16 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handles clicks on menu buttons"""
     query = update.callback_query
-    await query.answer()
-    
     user_id = str(update.effective_user.id)
     
+    if query.data == 'get_report' and user_addresses.get(user_id) and not shutdown_state['requested']:
+        retry_after = take_report_token(user_id)
+        if retry_after:
+            await query.answer(rate_limited_text(retry_after))
+            return
+    
+    await query.answer()
+    
     if query.data == 'set_address':
         await query.edit_message_text(
             "📝 <b>Set Address</b>\n\n"
@@ -729,9 +1961,14 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             return
         
+        if shutdown_state['requested']:
+            await query.edit_message_text(RESTARTING_TEXT, parse_mode='HTML')
+            return
+        
         await query.edit_message_text("⏳ <b>Retrieving data...</b>", parse_mode='HTML')
         
-        report = await generate_report(current_address)
+        sample_profile()
+        report = await run_tracked(request_report(user_id, current_address)) or RESTARTING_TEXT
         
         keyboard = [
             [InlineKeyboardButton("🔄 Refresh", callback_data='get_report')],
@@ -739,11 +1976,13 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
         
-        await query.edit_message_text(
-            report,
-            reply_markup=reply_markup,
-            parse_mode='HTML'
-        )
+        with perf_phase('telegram'):
+            await query.edit_message_text(
+                report,
+                reply_markup=reply_markup,
+                parse_mode='HTML'
+            )
+        await finish_profile()
     
     elif query.data == 'view_address':
         current_address = user_addresses.get(user_id, None)
@@ -798,20 +2037,21 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handles text messages (for address input)"""
     if context.user_data.get('waiting_for_address', False):
         user_id = str(update.effective_user.id)
-        address = update.message.text.strip()
+        address = normalize_address(update.message.text)
         
-        # Basic address validation
-        if not address.startswith('0x') or len(address) != 42:
+        # Address validation (format and EIP-55 checksum)
+        if not address:
             await update.message.reply_text(
-                "❌ <b>Invalid address format</b>\n\n"
-                "Please send a valid Ethereum address (starts with 0x and is 42 characters long).\n\n"
+                "❌ <b>Invalid address</b>\n\n"
+                "Please send a valid Ethereum address (starts with 0x and is 42 characters long). "
+                "Mixed-case addresses must have a valid checksum.\n\n"
                 "Example: <code>0xec0cf15a2857d39f9ff55bc532a977fa590e5161</code>",
                 parse_mode='HTML'
             )
             return
         
         # Save address
-        user_addresses[user_id] = address
+        set_user_address(user_id, address)
         save_user_addresses()
         
         context.user_data['waiting_for_address'] = False
@@ -853,11 +2093,15 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 /start - Show main menu
 /help - Show this help
 /report - Get your performance report (requires a registered address)
+/chart [period] - Vault TVL/PnL chart (day, week, month, allTime)
+/rank - Your rank among all HLP depositors
+/stats - Vault-wide depositor statistics
 
 <b>Features:</b>
 • Track your performance in the Hyperliquid HLP vault
 • View your daily and total PnL
 • Visualize global vault metrics
+• Share your report or a vault chart inline: type @botname in any chat
 • <b>NEW:</b> Reports show yesterday's calendar day performance
 
 <b>How to use:</b>
@@ -888,9 +2132,19 @@ async def report_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
     
+    if shutdown_state['requested']:
+        await update.message.reply_text(RESTARTING_TEXT, parse_mode='HTML')
+        return
+    
+    retry_after = take_report_token(user_id)
+    if retry_after:
+        await update.message.reply_text(rate_limited_text(retry_after))
+        return
+    
     message = await update.message.reply_text("⏳ <b>Retrieving data...</b>", parse_mode='HTML')
     
-    report = await generate_report(current_address)
+    sample_profile()
+    report = await run_tracked(request_report(user_id, current_address)) or RESTARTING_TEXT
     
     keyboard = [
         [InlineKeyboardButton("🔄 Refresh", callback_data='get_report')],
@@ -898,28 +2152,711 @@ async def report_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
     
-    await message.edit_text(
-        report,
-        reply_markup=reply_markup,
+    with perf_phase('telegram'):
+        await message.edit_text(
+            report,
+            reply_markup=reply_markup,
+            parse_mode='HTML'
+        )
+    await finish_profile()
+
+def resolve_chart_period(text):
+    """Returns the chart period matching a user input (case-insensitive), or None"""
+    periods = {period.lower(): period for period in CHART_PERIODS}
+    return periods.get(text.strip().lower())
+
+async def chart_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handles the /chart command"""
+    period = resolve_chart_period(context.args[0]) if context.args else 'month'
+    
+    if not period:
+        await update.message.reply_text(
+            "❌ <b>Unknown period</b>\n\n"
+            "Available periods: <code>day</code>, <code>week</code>, <code>month</code>, <code>allTime</code>",
+            parse_mode='HTML'
+        )
+        return
+    
+    vault_data = await asyncio.to_thread(get_vault_snapshot)
+    if not vault_data:
+        await update.message.reply_text("⚠️ Error retrieving vault data")
+        return
+    
+    entry = await get_chart(vault_data, period)
+    if not entry:
+        await update.message.reply_text("⚠️ No chart data available for this period")
+        return
+    
+    await send_chart(context.bot, update.effective_chat.id, entry, caption=f"📈 HLP Vault - {period}")
+
+# Background chart preparations started by inline queries, referenced until done
+_background_tasks = set()
+
+def spawn_background(coroutine):
+    """Runs a coroutine in the background without awaiting it"""
+    task = asyncio.get_running_loop().create_task(coroutine)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+# Inline chart preparations in progress: period -> task
+_inline_chart_jobs = {}
+
+async def prepare_inline_chart(bot, period):
+    """Renders the current chart of a period and uploads it to CHART_CACHE_CHAT_ID if set"""
+    try:
+        vault_data = await asyncio.to_thread(get_vault_snapshot)
+        entry = await get_chart(vault_data, period) if vault_data else None
+        # Inline results can only reference uploaded photos: upload once to the cache chat
+        if entry and not entry['file_id'] and CHART_CACHE_CHAT_ID:
+            await send_chart(bot, CHART_CACHE_CHAT_ID, entry)
+    except Exception as e:
+        print(f"Error preparing inline chart: {e}")
+    finally:
+        _inline_chart_jobs.pop(period, None)
+
+async def inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handles inline queries (@bot [period]): the user's report and the vault chart
+
+    Telegram sends a query per keystroke, so answers only use what is already built
+    (last report, uploaded chart); anything missing or stale is prepared in the
+    background for the next queries. A report token is only spent on generation.
+    """
+    query = update.inline_query
+    user_id = str(update.effective_user.id)
+    period = resolve_chart_period(query.query) or 'month'
+    results = []
+    preparing = False
+    
+    current_address = user_addresses.get(user_id, None)
+    if current_address:
+        last = last_reports.get(current_address)
+        stale = last is None or time.monotonic() - last[0] > VAULT_CACHE_TTL
+        if stale and _report_queue is not None and not shutdown_state['requested']:
+            if current_address in _pending_reports:
+                preparing = True
+            elif not take_report_token(user_id):
+                enqueue_report(user_id, current_address)
+                last_report_at[user_id] = time.monotonic()
+                preparing = True
+        if last is not None:
+            results.append(InlineQueryResultArticle(
+                id='report',
+                title="📊 My HLP Report",
+                description="Share your HLP vault performance",
+                input_message_content=InputTextMessageContent(last[1], parse_mode='HTML')
+            ))
+    
+    if period not in _inline_chart_jobs and not shutdown_state['requested']:
+        # Cheap when the current chart is already rendered and uploaded
+        _inline_chart_jobs[period] = spawn_background(prepare_inline_chart(context.bot, period))
+    entry = chart_cache.get(latest_chart_keys.get(period))
+    if entry and entry['file_id']:
+        results.append(InlineQueryResultCachedPhoto(
+            id=f"chart_{period}",
+            photo_file_id=entry['file_id'],
+            title=f"📈 HLP Vault - {period}",
+            caption=f"📈 HLP Vault - {period}"
+        ))
+    elif CHART_CACHE_CHAT_ID:
+        preparing = True
+    
+    # Telegram caches answers: do not keep an incomplete one
+    await query.answer(results, cache_time=0 if preparing else 60, is_personal=True)
+
+# Set once a stop signal is received: handlers stop starting new work
+shutdown_state = {'requested': False}
+
+# Report generations currently running
+_inflight_jobs = set()
+
+# Callables run at shutdown to checkpoint interrupted jobs into bot_state
+checkpoint_callbacks = []
+
+RESTARTING_TEXT = "🔄 <b>The bot is restarting</b>\n\nPlease try again in a moment."
+
+async def run_tracked(coroutine):
+    """Runs a job so that shutdown can wait for it
+
+    Returns None if the job had to be cancelled because the drain deadline expired.
+    """
+    job = asyncio.ensure_future(coroutine)
+    _inflight_jobs.add(job)
+    job.add_done_callback(_inflight_jobs.discard)
+    try:
+        return await job
+    except asyncio.CancelledError:
+        if shutdown_state['requested'] and job.cancelled():
+            return None
+        raise
+
+async def drain_inflight_jobs(timeout):
+    """Waits for in-flight jobs, cancelling whatever is still running after the deadline"""
+    if not _inflight_jobs:
+        return
+    print(f"Draining {len(_inflight_jobs)} in-flight job(s)...")
+    done, pending = await asyncio.wait(set(_inflight_jobs), timeout=timeout)
+    for job in pending:
+        job.cancel()
+    if pending:
+        print(f"Cancelled {len(pending)} job(s) still running after {timeout:g}s")
+
+async def drain_and_stop(application):
+    """Stops fetching updates, drains in-flight reports, then stops the application
+
+    A broadcast can take far longer than the drain deadline: it is interrupted
+    right away instead, and resumes from its cursor after the restart.
+    """
+    try:
+        await stop_broadcast()
+        if application.updater and application.updater.running:
+            await application.updater.stop()
+        await drain_inflight_jobs(SHUTDOWN_DRAIN_TIMEOUT)
+        stop_report_workers()
+    finally:
+        application.stop_running()
+
+def request_shutdown(application):
+    """Stop signal handler: starts a graceful shutdown (a second signal is ignored)"""
+    if shutdown_state['requested']:
+        return
+    shutdown_state['requested'] = True
+    print("Stop signal received, shutting down gracefully...")
+    asyncio.get_running_loop().create_task(drain_and_stop(application))
+
+def install_shutdown_handlers(application):
+    """Replaces the default stop signal handlers with the graceful shutdown"""
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, request_shutdown, application)
+        except (NotImplementedError, RuntimeError):
+            # Windows: keep the default handling, state is still flushed on shutdown
+            return
+
+async def flush_state(application):
+    """Writes everything that must survive a restart (runs after the application stopped)"""
+    await stop_broadcast()
+    for checkpoint in checkpoint_callbacks:
+        try:
+            checkpoint()
+        except Exception as e:
+            print(f"Error checkpointing job: {e}")
+    save_bot_state()
+    save_perf_stats()
+    if _addresses_dirty:
+        save_user_addresses()
+    save_caches()
+    stop_report_workers()
+    shutdown_chart_pool()
+    print("State flushed, bye")
+
+async def warm_up(application):
+    """Pre-warms the vault snapshot, depositor index and data source (SDK client) before serving updates
+
+    Runs concurrently with a bounded deadline: whatever is not ready in time keeps
+    loading in the background and the bot starts anyway.
+    """
+    warmup_started = time.perf_counter()
+    jobs = {
+        'vault snapshot': asyncio.ensure_future(asyncio.to_thread(get_vault_snapshot)),
+        'depositor index': asyncio.ensure_future(asyncio.to_thread(get_depositor_index, HLP_VAULT_ADDRESS)),
+        'data source setup': asyncio.ensure_future(asyncio.to_thread(get_data_source().prepare))
+    }
+    
+    done, pending = await asyncio.wait(jobs.values(), timeout=STARTUP_WARMUP_TIMEOUT)
+    for name, job in jobs.items():
+        if job in pending:
+            print(f"Warm-up: {name} not ready after {STARTUP_WARMUP_TIMEOUT:g}s, continuing in background")
+        elif job.exception() is not None:
+            print(f"Warm-up: {name} failed: {job.exception()}")
+    
+    print(f"Warm-up done in {time.perf_counter() - warmup_started:.2f}s ({len(done)}/{len(jobs)} ready)")
+    print(f"Time to ready: {time.perf_counter() - _process_started:.2f}s")
+
+async def on_startup(application):
+    """Application post_init hook"""
+    install_shutdown_handlers(application)
+    start_report_workers()
+    await warm_up(application)
+    resume_pending_broadcast(application.bot)
+
+DEPOSITORS_UNAVAILABLE_TEXT = (
+    "⚠️ <b>Depositor data unavailable</b>\n\n"
+    "Vault-wide rankings require the vaults-analyser depositor list."
+)
+
+async def rank_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handles the /rank command"""
+    user_id = str(update.effective_user.id)
+    current_address = user_addresses.get(user_id, None)
+    
+    if not current_address:
+        keyboard = [
+            [InlineKeyboardButton("📝 Set My Address", callback_data='set_address')]
+        ]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        
+        await update.message.reply_text(
+            "⚠️ <b>No address registered</b>\n\n"
+            "Please set your wallet address first to get your rank.",
+            reply_markup=reply_markup,
+            parse_mode='HTML'
+        )
+        return
+    
+    rank = await asyncio.to_thread(get_user_rank, current_address)
+    
+    if rank is None:
+        await update.message.reply_text(DEPOSITORS_UNAVAILABLE_TEXT, parse_mode='HTML')
+        return
+    if not rank:
+        await update.message.reply_text(
+            "⚠️ <b>Position not found</b>\n\n"
+            "Your address is not in the HLP depositor list.",
+            parse_mode='HTML'
+        )
+        return
+    
+    await update.message.reply_text(
+        f"<b>🏆 Your HLP Rank</b> (among {rank['count']:,} depositors)\n\n"
+        f"• Equity: ${rank['equity']:,.2f} - #{rank['equity_rank']:,} (top {rank['equity_top_percent']:.2f}%)\n"
+        f"• All-time PnL: ${rank['all_time_pnl']:,.2f} - #{rank['pnl_rank']:,} (top {rank['pnl_top_percent']:.2f}%)",
+        parse_mode='HTML'
+    )
+
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handles the /stats command"""
+    depositor_index = await asyncio.to_thread(get_depositor_index, HLP_VAULT_ADDRESS)
+    
+    if not depositor_index:
+        await update.message.reply_text(DEPOSITORS_UNAVAILABLE_TEXT, parse_mode='HTML')
+        return
+    
+    stats = await asyncio.to_thread(get_depositor_stats, depositor_index)
+    
+    await update.message.reply_text(
+        "<b>📊 HLP Depositor Stats</b>\n\n"
+        f"• Depositors: {stats['count']:,}\n"
+        f"• Total equity: ${stats['total_equity']:,.2f}\n"
+        f"• Median equity: ${stats['median_equity']:,.2f}\n"
+        f"• Median deposit: ${stats['median_deposit']:,.2f}\n"
+        f"• Top 100 hold: {stats['top100_share']:.2f}% of equity\n"
+        f"• Total all-time PnL: ${stats['total_all_time_pnl']:,.2f}\n"
+        f"• In profit: {stats['profitable_share']:.1f}% of depositors",
         parse_mode='HTML'
     )
 
+def reset_snapshot_caches():
+    """Forgets everything memoised per vault snapshot"""
+    _report_header_cache['entry'] = None
+    _returns_cache['entry'] = None
+    _snapshot_cache['entry'] = None
+    _follower_index_cache['entry'] = None
+
+def load_capture(path):
+    """Loads a capture written by capture_report_inputs"""
+    with gzip.open(path, 'rt') as f:
+        return json.load(f)
+
+def replay_capture(capture):
+    """Rebuilds the report of a capture with the clock frozen at capture time"""
+    global _frozen_now
+    
+    depositor_index = None
+    if capture.get('depositors_available'):
+        depositor_index = {d['user'].lower(): d for d in capture.get('depositors', [])}
+    
+    _frozen_now = datetime.fromtimestamp(capture['captured_at'] / 1000, timezone.utc)
+    try:
+        snapshot = prepare_vault_snapshot(capture['vault_details'])
+        return render_report(snapshot, capture['wallet_address'], capture['vault_equities'], depositor_index)
+    finally:
+        _frozen_now = None
+
+def replay_main(args):
+    """Command line entry point: python hlp-notifier.py replay CAPTURE [--profile N]"""
+    import argparse
+    
+    parser = argparse.ArgumentParser(prog="hlp-notifier.py replay", description="Replay a captured report offline")
+    parser.add_argument("capture", help="capture file (capture-*.json.gz)")
+    parser.add_argument("--profile", type=int, metavar="N", default=0,
+                        help="profile N cold replays of the report hot path")
+    options = parser.parse_args(args)
+    
+    capture = load_capture(options.capture)
+    print(f"Replaying {capture['wallet_address']} at {datetime.fromtimestamp(capture['captured_at'] / 1000, timezone.utc).isoformat()}")
+    print(replay_capture(capture))
+    
+    if options.profile > 0:
+        import cProfile
+        import pstats
+        
+        profiler = cProfile.Profile()
+        for _ in range(options.profile):
+            reset_snapshot_caches()
+            profiler.runcall(replay_capture, capture)
+        pstats.Stats(profiler).sort_stats('cumulative').print_stats(25)
+
+def is_admin(update: Update):
+    """True when the update comes from a user listed in ADMIN_USER_IDS"""
+    return str(update.effective_user.id) in ADMIN_USER_IDS
+
+async def perf_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handles the /perf command (admin only): aggregated report timings"""
+    if not is_admin(update):
+        return
+    
+    if PROFILE_SAMPLE_RATE <= 0:
+        await update.message.reply_text("ℹ️ Profiling is disabled (set PROFILE_SAMPLE_RATE).")
+        return
+    if not perf_stats:
+        await update.message.reply_text(f"ℹ️ No report sampled yet (sample rate {PROFILE_SAMPLE_RATE:g}).")
+        return
+    
+    text = f"<b>⏱ Report timings</b> ({_perf_samples} sampled, rate {PROFILE_SAMPLE_RATE:g})\n\n"
+    text += f"<pre>{html.escape(format_perf_stats())}</pre>"
+    
+    cprofile_text = format_cprofile_stats()
+    if cprofile_text:
+        # Telegram messages are limited to 4096 characters
+        text += f"\n<pre>{html.escape(cprofile_text[:3000])}</pre>"
+    elif PROFILE_CPROFILE and not CPROFILE_IN_PROCESS:
+        text += "\nℹ️ cProfile is not run in the bot on Python 3.12+ (it would mix threads): use <code>replay --profile</code> on a capture."
+    
+    await update.message.reply_text(text, parse_mode='HTML')
+
+# Broadcast: the job state lives in bot_state['broadcast'] and per-recipient delivery
+# statuses are appended to BROADCAST_LOG_DIR/<id>.jsonl, so an interrupted broadcast
+# resumes after the last completed page without re-sending.
+_broadcast_task = None
+_broadcast_pacing = {'next_send': 0.0}
+
+def next_recipient_page(cursor, page_size):
+    """Returns the next page of user_ids after cursor, in numeric order, without sorting everyone"""
+    after = int(cursor) if cursor is not None else -1
+    return heapq.nsmallest(page_size, (user_id for user_id in user_addresses if int(user_id) > after), key=int)
+
+def next_wallet_page(cursor, page_size):
+    """Returns the next page of tracked wallets after cursor, in address order (report broadcasts)"""
+    return heapq.nsmallest(page_size, (wallet for wallet in wallet_users if cursor is None or wallet > cursor))
+
+def broadcast_log_path(broadcast_id):
+    """Delivery log of a broadcast"""
+    return os.path.join(BROADCAST_LOG_DIR, f"{broadcast_id}.jsonl")
+
+def handled_after_cursor(log_path, cursor, by_wallet=False):
+    """Returns the user_ids of the interrupted page that were already handled
+
+    Pages are ordered by numeric user_id, or by wallet for report broadcasts.
+    """
+    handled = set()
+    if os.path.exists(log_path):
+        with open(log_path, 'r') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    user_id = entry['user_id']
+                    position = entry['wallet'] if by_wallet else int(user_id)
+                except (ValueError, KeyError):
+                    continue  # line cut by a kill
+                if cursor is None or position > (cursor if by_wallet else int(cursor)):
+                    handled.add(user_id)
+    return handled
+
+async def wait_broadcast_slot():
+    """Paces broadcast messages to BROADCAST_RATE per second across all workers"""
+    loop = asyncio.get_running_loop()
+    now = loop.time()
+    slot = max(now, _broadcast_pacing['next_send'])
+    _broadcast_pacing['next_send'] = slot + 1 / BROADCAST_RATE
+    await asyncio.sleep(slot - now)
+
+async def send_broadcast_message(bot, user_id, text, parse_mode=None):
+    """Sends one broadcast message, returns (status, error) with status 'sent', 'blocked' or 'failed'"""
+    for _ in range(3):
+        await wait_broadcast_slot()
+        try:
+            await bot.send_message(chat_id=int(user_id), text=text, parse_mode=parse_mode)
+            return 'sent', None
+        except RetryAfter as e:
+            # Flood control: pause every worker, then retry
+            delay = e.retry_after.total_seconds() if isinstance(e.retry_after, timedelta) else e.retry_after
+            loop = asyncio.get_running_loop()
+            _broadcast_pacing['next_send'] = max(_broadcast_pacing['next_send'], loop.time() + delay)
+        except Forbidden as e:
+            return 'blocked', str(e)
+        except BadRequest as e:
+            if 'chat not found' in str(e).lower():
+                return 'blocked', str(e)
+            return 'failed', str(e)
+        except TimedOut:
+            continue
+        except TelegramError as e:
+            return 'failed', str(e)
+    return 'failed', "Too many retries"
+
+async def notify_broadcast_admin(bot, state, title):
+    """Sends the broadcast status to the admin who started it"""
+    try:
+        await bot.send_message(
+            chat_id=state['admin_chat_id'],
+            text=f"📣 <b>{title}</b>\n\n{format_broadcast_status(state)}",
+            parse_mode='HTML'
+        )
+    except TelegramError as e:
+        print(f"Error notifying broadcast admin: {e}")
+
+async def run_broadcast(bot):
+    """Sends bot_state['broadcast'] to every registered user, resuming from its cursor
+
+    Report broadcasts ('kind': 'report') send each user their own report instead of a
+    text: they page through wallets, so each report is built once and delivered to every
+    user tracking that wallet.
+    """
+    state = bot_state['broadcast']
+    is_report = state.get('kind') == 'report'
+    # Message broadcasts store the admin's text as HTML (older states hold plain text)
+    parse_mode = 'HTML' if is_report else state.get('parse_mode')
+    os.makedirs(BROADCAST_LOG_DIR, exist_ok=True)
+    log_path = broadcast_log_path(state['id'])
+    handled = handled_after_cursor(log_path, state['cursor'], by_wallet=is_report)
+    # Users who blocked the bot in the current page (already removed, not saved yet)
+    pruned = []
+    
+    try:
+        with open(log_path, 'a') as log:
+            while True:
+                if is_report:
+                    page = next_wallet_page(state['cursor'], BROADCAST_PAGE_SIZE)
+                else:
+                    page = next_recipient_page(state['cursor'], BROADCAST_PAGE_SIZE)
+                if not page:
+                    break
+                
+                if is_report:
+                    recipients = [
+                        (user_id, wallet)
+                        for wallet in page
+                        for user_id in sorted(wallet_users.get(wallet, ()), key=int)
+                        if user_id not in handled
+                    ]
+                    reports = await generate_reports(dict.fromkeys(wallet for _, wallet in recipients))
+                    if reports is None:
+                        # Nothing is sent without vault data: pause, the admin resumes later
+                        state['status'] = 'interrupted'
+                        save_bot_state()
+                        await notify_broadcast_admin(bot, state, "Broadcast paused: vault data unavailable (/broadcast resume)")
+                        return
+                else:
+                    recipients = [(user_id, None) for user_id in page if user_id not in handled]
+                
+                queue = asyncio.Queue()
+                for recipient in recipients:
+                    queue.put_nowait(recipient)
+                
+                async def worker():
+                    while not queue.empty():
+                        user_id, wallet = queue.get_nowait()
+                        text = reports[wallet] if is_report else state['text']
+                        if text is None:
+                            status, error = 'failed', "Report generation failed"
+                        else:
+                            status, error = await send_broadcast_message(bot, user_id, text, parse_mode)
+                        entry = {'user_id': user_id, 'status': status, 'error': error}
+                        if is_report:
+                            entry['wallet'] = wallet
+                        log.write(json.dumps(entry) + "\n")
+                        state[status] += 1
+                        # Users who blocked the bot will never receive anything again: removed
+                        # right away, as a resumed page skips the users it already handled
+                        if status == 'blocked':
+                            remove_user_address(user_id)
+                            pruned.append(user_id)
+                
+                await asyncio.gather(*(worker() for _ in range(BROADCAST_WORKERS)))
+                log.flush()
+                
+                if pruned:
+                    save_user_addresses()
+                    pruned.clear()
+                
+                state['cursor'] = page[-1]
+                handled = set()
+                save_bot_state()
+    except asyncio.CancelledError:
+        state['status'] = 'interrupted'
+        save_bot_state()
+        if pruned:
+            save_user_addresses()
+        raise
+    
+    state['status'] = 'done'
+    state['finished_at'] = int(time.time())
+    save_bot_state()
+    print(f"Broadcast {state['id']} done: {format_broadcast_status(state)}")
+    await notify_broadcast_admin(bot, state, "Broadcast finished")
+
+def start_broadcast_task(bot):
+    """Runs the broadcast in the background (not drained at shutdown, see stop_broadcast)"""
+    global _broadcast_task
+    _broadcast_task = asyncio.get_running_loop().create_task(run_broadcast(bot))
+
+def broadcast_running():
+    """True while a broadcast task is sending"""
+    return _broadcast_task is not None and not _broadcast_task.done()
+
+async def stop_broadcast():
+    """Cancels a running broadcast: it checkpoints its cursor and resumes on the next start"""
+    if broadcast_running():
+        _broadcast_task.cancel()
+        await asyncio.wait([_broadcast_task])
+
+def resume_pending_broadcast(bot):
+    """Restarts a broadcast interrupted by a restart"""
+    state = bot_state.get('broadcast')
+    if state and state.get('status') in ('running', 'interrupted') and not broadcast_running():
+        print(f"Resuming broadcast {state['id']} after {state['cursor']}")
+        state['status'] = 'running'
+        start_broadcast_task(bot)
+        return True
+    return False
+
+def checkpoint_broadcast():
+    """Shutdown checkpoint: an unfinished broadcast is marked as interrupted"""
+    state = bot_state.get('broadcast')
+    if state and state.get('status') == 'running':
+        state['status'] = 'interrupted'
+
+checkpoint_callbacks.append(checkpoint_broadcast)
+
+def format_broadcast_status(state):
+    """One-line summary of a broadcast"""
+    return (
+        f"Status: {state['status']} • ✅ {state['sent']} sent • "
+        f"🚫 {state['blocked']} blocked (removed) • ❌ {state['failed']} failed"
+    )
+
+# /broadcast keywords: a message made of one of these words is sent with /broadcast send <message>
+BROADCAST_KEYWORDS = ('report', 'status', 'resume')
+
+def split_broadcast_command(message):
+    """Returns what follows the command of a /broadcast message, as (plain text, HTML)
+
+    The command is cut at its bot_command entity (the message may start on the
+    next line) and the HTML form keeps the admin's formatting.
+    """
+    entities = message.entities or ()
+    if entities and entities[0].type == MessageEntity.BOT_COMMAND and entities[0].offset == 0:
+        command = message.parse_entity(entities[0])
+    else:
+        command = message.text.split(None, 1)[0]
+    # Commands are plain ASCII: the same prefix length applies to the HTML form
+    return message.text[len(command):].strip(), message.text_html[len(command):].strip()
+
+async def broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handles the /broadcast command (admin only)
+
+    /broadcast <message> sends a message to every registered user, /broadcast report
+    sends each user their report, /broadcast status shows progress and
+    /broadcast resume restarts an interrupted one. /broadcast send <message> sends
+    a message even when it is one of these keywords.
+    """
+    if not is_admin(update):
+        return
+    
+    plain, text = split_broadcast_command(update.message)
+    keyword = plain.lower() if plain.lower() in BROADCAST_KEYWORDS else None
+    if plain.split(None, 1)[:1] == ['send'] and text.startswith('send'):
+        plain, text = plain[4:].strip(), text[4:].strip()
+    state = bot_state.get('broadcast')
+    
+    if not plain or keyword == 'status':
+        if state:
+            await update.message.reply_text(f"📣 <b>Broadcast {state['id']}</b>\n\n{format_broadcast_status(state)}", parse_mode='HTML')
+        else:
+            await update.message.reply_text("Usage: /broadcast <message> | report | status | resume | send <message>")
+        return
+    
+    if keyword == 'resume':
+        if resume_pending_broadcast(context.bot):
+            await update.message.reply_text("📣 Broadcast resumed")
+        else:
+            await update.message.reply_text("ℹ️ No interrupted broadcast to resume")
+        return
+    
+    if broadcast_running() or (state and state.get('status') in ('running', 'interrupted')):
+        await update.message.reply_text("⚠️ A broadcast is already in progress (/broadcast status, /broadcast resume)")
+        return
+    
+    is_report = keyword == 'report'
+    bot_state['broadcast'] = {
+        'id': str(int(time.time())),
+        'kind': 'report' if is_report else 'message',
+        'text': None if is_report else text,
+        'parse_mode': 'HTML',
+        'admin_chat_id': update.effective_chat.id,
+        'cursor': None,
+        'status': 'running',
+        'sent': 0,
+        'blocked': 0,
+        'failed': 0
+    }
+    save_bot_state()
+    start_broadcast_task(context.bot)
+    
+    what = "Report broadcast" if is_report else "Broadcast"
+    await update.message.reply_text(f"📣 {what} started to {len(user_addresses)} user(s)")
+
 def main():
     """Main function"""
+    if len(sys.argv) > 1 and sys.argv[1] == "replay":
+        replay_main(sys.argv[2:])
+        return
+    
+    if not TELEGRAM_BOT_TOKEN:
+        raise ValueError(
+            "TELEGRAM_BOT_TOKEN environment variable is required. "
+            "Please set it in your environment or Railway settings."
+        )
+    
+    # Fails fast on an invalid DATA_SOURCE / FAKE_DATA_FILE instead of at the first report
+    get_data_source()
+    
+    if PROFILE_CPROFILE and not CPROFILE_IN_PROCESS:
+        print("PROFILE_CPROFILE ignored on Python 3.12+ (cProfile records every thread): use 'replay --profile' on a capture")
+    
     print("HLP Performance Tracker Bot v2 started")
     print("NEW: Calculates yesterday's calendar day performance")
     
     # Load saved addresses
     load_user_addresses()
     print(f"Loaded addresses: {len(user_addresses)} user(s)")
+    load_bot_state()
+    load_caches()
     
     # Create Telegram application
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+    # Updates are handled concurrently (bounded) so one slow report or chart does not
+    # hold back other users: report generation itself is bounded by the report queue
+    application = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .concurrent_updates(REPORT_WORKERS * 4)
+        .post_init(on_startup)
+        .post_shutdown(flush_state)
+        .build()
+    )
     
     # Add handlers
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("help", help_command))
     application.add_handler(CommandHandler("report", report_command))
+    application.add_handler(CommandHandler("chart", chart_command))
+    application.add_handler(CommandHandler("rank", rank_command))
+    application.add_handler(CommandHandler("stats", stats_command))
+    application.add_handler(CommandHandler("perf", perf_command))
+    application.add_handler(CommandHandler("broadcast", broadcast_command))
+    application.add_handler(InlineQueryHandler(inline_query))
     application.add_handler(CallbackQueryHandler(button_handler))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
     